@@ -1,32 +1,53 @@
+import time
+_import_start = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-from catboost import CatBoostClassifier
-import shap
-import matplotlib.pyplot as plt
 import numpy as np
-import joblib
 import os
-from datetime import datetime
-import csv
-import platform
-import pytz
-
-# 在文件顶部添加平台检测
-is_windows = platform.system() == 'Windows'
-
-# 动态获取当前脚本所在目录
-base_dir = os.path.dirname(os.path.abspath(__file__))
-model_path = os.path.join(base_dir, "model", "catboost_model.cbm")
-explainer_path = os.path.join(base_dir, "model", "explainer.shap")
-
-# 根据操作系统选择不同的历史文件路径
-if is_windows:
-    history_dir = os.path.join(base_dir, "history")
-    history_path = os.path.join(history_dir, "prediction_history.csv")
-else:
-    # 在Streamlit Cloud上使用/tmp目录确保有写入权限
-    history_dir = "/tmp/history"
-    history_path = os.path.join(history_dir, "prediction_history.csv")
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+
+import explain_pool
+import history_store
+import startup_profile
+from metrics import get_metrics, span, start_configured_exporters
+from model_registry import get_registry, DEFAULT_MODEL_PATH, DEFAULT_EXPLAINER_PATH
+from feature_schema import FEATURE_SCHEMA
+from features import FEATURES, UNITS, RISK_COLORS, risk_level as get_risk_level
+from history_aggregates import RISK_BANDS
+from batch_scoring import read_patient_file, score_batch
+from prediction_cache import get_prediction_cache
+from rescore import get_rescore_job
+from cohort_shap import (get_cohort_shap_job, load_summary as load_cohort_shap_summary, global_importance,
+                         SHAP_COLUMNS)
+from history_jobs import history_changed
+from shadow import get_shadow_scorer
+from render import force_plot_svg, waterfall_svg, force_plot_png, heatmap_svg, beeswarm_svg
+from what_if import cached_score_grid, nearest_index
+
+# 只有首次执行脚本时才真正导入，之后的重跑直接使用已加载的模块
+startup_profile.record_once("import app modules", "import", time.perf_counter() - _import_start)
+# 每次重跑都会重新执行到这里，用于统计整次重跑的耗时
+_rerun_start = time.perf_counter()
+
+# 解释图渲染方式: svg（力图，默认）、waterfall（瀑布图）、matplotlib（shap.force_plot 后备）
+PLOT_RENDERER = os.environ.get("DR_PLOT_RENDERER", "svg").lower()
+
+# 模型文件路径
+model_path = DEFAULT_MODEL_PATH
+explainer_path = DEFAULT_EXPLAINER_PATH
+
+# 启动模式: eager（显示登录页前加载模型）、lazy（首次评估时加载）、
+# prewarm（默认，登录页显示后在后台线程预加载，首次评估时若未完成则等待）
+STARTUP_MODE = os.environ.get("DR_STARTUP_MODE", "prewarm").lower()
+
+# 历史记录存储（默认 SQLite，路径按操作系统选择，见 history_store）
+history_dir = history_store.HISTORY_DIR
+history_store_backend = history_store.get_store()
+# 保存记录经由后台写入线程合并提交，界面线程不等待磁盘
+history_writer = history_store.get_writer()
+history_path = history_store_backend.path
 
 # 确保历史记录目录存在
 os.makedirs(history_dir, exist_ok=True)
@@ -65,6 +86,26 @@ translations = {
         'select_records': 'Select records to delete (by index):',
         'delete_selected': 'Delete Selected Records',
         'download_history': 'Download History as CSV',
+        'startup_report': 'Startup Report',
+        'metrics_panel': 'Metrics',
+        'explaining': 'Computing feature contributions...',
+        'explain_timeout': 'The explanation is taking longer than {seconds:g}s; click Start Assessment again to load it when ready.',
+        'trends': 'Trends',
+        'daily_band_counts': 'Assessments per day by risk level',
+        'patient_trajectory': 'Risk trajectory',
+        'select_patient_for_trend': 'Select a patient under "Matching names" to see their risk trajectory.',
+        'band_feature_means': 'Mean indicator values by risk level',
+        'what_if': 'What-if Analysis',
+        'what_if_features': 'Indicators to vary (up to 2)',
+        'what_if_curve': 'Risk probability as the indicator varies (other indicators fixed)',
+        'what_if_shap': 'SHAP contribution of the varied indicator',
+        'what_if_point': 'Risk at the selected value',
+        'what_if_current': 'current input',
+        'metrics_stage': 'Stage',
+        'latency_ms': 'Latency (ms, bucket upper bound)',
+        'cache_hit_rate': 'Prediction Cache Hit Rate',
+        'history_store_size': 'History Records / Size',
+        'download_metrics': 'Download Prometheus Metrics',
         'no_history': 'No prediction history yet.',
         'logout': 'Logout',
         'logged_in_as': 'Logged in as',
@@ -89,7 +130,59 @@ translations = {
         'file_content': 'File content',
         'failed_to_read_file': 'Failed to read file content',
         'create_sample_data': 'Create Sample Data',
-        'sample_patient': 'Sample Patient'
+        'sample_patient': 'Sample Patient',
+        'batch_assessment': 'Batch Assessment',
+        'batch_upload': 'Upload a CSV or Parquet file with the 10 indicator columns',
+        'batch_start': 'Score File',
+        'batch_progress': 'Scored',
+        'batch_done': 'Batch scoring finished',
+        'batch_invalid': 'rows with invalid or out-of-range values were not scored (see Validation_Issues)',
+        'batch_saved': 'records saved to prediction history',
+        'download_batch': 'Download Batch Results',
+        'matching_names': 'Matching names',
+        'date_range': 'Date range',
+        'sort_by': 'Sort by',
+        'descending': 'Descending',
+        'page_size': 'Rows per page',
+        'page': 'Page',
+        'showing_records': 'Showing {start}-{end} of {total} records',
+        'confirm_delete_matching': 'I confirm deleting all {total} records matching the current filters',
+        'delete_matching': 'Delete Matching Records',
+        'records_deleted': '{count} records deleted.',
+        'download_history_parquet': 'Download History as Parquet',
+        'archive_before': 'Archive records before',
+        'archive_records': 'Move Old Records to Archive',
+        'confirm_archive': 'I confirm moving {total} records before {date} to the archive',
+        'records_archived': '{count} records archived to {path}',
+        'invalid_value': 'Please enter a valid number for {feat}',
+        'out_of_range_value': '{feat} is outside the valid range {low:g}–{high:g} {unit}',
+        'missing_required': '{feat} is required',
+        'missing_as_zero': 'Empty indicators are scored as 0: {features}',
+        'fix_inputs': 'Please correct the flagged indicators before assessment.',
+        'rescore_history': 'Re-score History with Current Model',
+        'rescore_start': 'Start / Resume Re-scoring',
+        'rescore_cancel': 'Pause Re-scoring',
+        'rescore_progress': 'Re-scored',
+        'rescore_done': 'Re-scoring finished: {done} records scored by model {version}',
+        'rescore_cancelled': 'Re-scoring paused at {done}/{total}; start again to resume.',
+        'rescore_failed': 'Re-scoring failed',
+        'cohort_shap': 'Cohort Explanations',
+        'cohort_shap_start': 'Compute / Update Cohort SHAP',
+        'cohort_shap_cancel': 'Pause',
+        'cohort_shap_progress': 'Explained',
+        'cohort_shap_done': 'Cohort SHAP up to date: {done} records explained by model {version}',
+        'cohort_shap_cancelled': 'Cohort SHAP paused at {done}/{total}; start again to resume.',
+        'cohort_shap_failed': 'Cohort SHAP failed',
+        'cohort_shap_empty': 'Cohort SHAP has not been computed yet.',
+        'cohort_shap_summary': '{explained} records explained by model {version} (sample of {sampled} for plots)',
+        'cohort_shap_stale': 'Computed with model {version}; the current model is {current}. Update to recompute.',
+        'cohort_shap_outdated': 'Records were deleted or archived since the last update; update to rebuild.',
+        'global_importance': 'Global importance (mean |SHAP|)',
+        'importance_by_band': 'Mean |SHAP| by risk band',
+        'cohort_band': 'Risk band',
+        'shap_summary': 'SHAP summary (color: low → high indicator value)',
+        'dependence_plot': 'Dependence plot',
+        'dependence_feature': 'Indicator'
     },
     'zh': {
         'title': '糖尿病视网膜病变风险评估系统',
@@ -115,6 +208,26 @@ translations = {
         'select_records': '选择要删除的记录（按索引）:',
         'delete_selected': '删除选中的记录',
         'download_history': '下载历史记录',
+        'startup_report': '启动耗时报告',
+        'metrics_panel': '性能指标',
+        'explaining': '正在计算特征贡献...',
+        'explain_timeout': '解释图计算超过 {seconds:g} 秒，完成后再次点击开始评估即可显示',
+        'trends': '趋势',
+        'daily_band_counts': '每日各风险等级的评估次数',
+        'patient_trajectory': '风险变化趋势',
+        'select_patient_for_trend': '在“匹配的姓名”中选择一位患者以查看其风险变化趋势',
+        'band_feature_means': '各风险等级的指标均值',
+        'what_if': '假设分析',
+        'what_if_features': '要变化的指标（最多 2 项）',
+        'what_if_curve': '其余指标不变时风险概率随该指标的变化',
+        'what_if_shap': '变化指标的 SHAP 贡献',
+        'what_if_point': '所选取值下的风险',
+        'what_if_current': '当前输入',
+        'metrics_stage': '阶段',
+        'latency_ms': '延迟（毫秒，桶上界）',
+        'cache_hit_rate': '评估缓存命中率',
+        'history_store_size': '历史记录条数 / 大小',
+        'download_metrics': '下载 Prometheus 指标',
         'no_history': '暂无预测历史',
         'logout': '退出登录',
         'logged_in_as': '登录身份',
@@ -139,7 +252,59 @@ translations = {
         'file_content': '文件内容',
         'failed_to_read_file': '读取文件内容失败',
         'create_sample_data': '创建示例数据',
-        'sample_patient': '示例患者'
+        'sample_patient': '示例患者',
+        'batch_assessment': '批量评估',
+        'batch_upload': '上传包含10项指标列的 CSV 或 Parquet 文件',
+        'batch_start': '开始批量评估',
+        'batch_progress': '已评估',
+        'batch_done': '批量评估完成',
+        'batch_invalid': '行含无效或超出范围的值，未评估（见 Validation_Issues 列）',
+        'batch_saved': '条记录已保存到预测历史',
+        'download_batch': '下载批量评估结果',
+        'matching_names': '匹配的姓名',
+        'date_range': '日期范围',
+        'sort_by': '排序字段',
+        'descending': '降序',
+        'page_size': '每页行数',
+        'page': '页码',
+        'showing_records': '显示第 {start}-{end} 条，共 {total} 条记录',
+        'confirm_delete_matching': '确认删除符合当前筛选条件的全部 {total} 条记录',
+        'delete_matching': '删除符合条件的记录',
+        'records_deleted': '已删除 {count} 条记录',
+        'download_history_parquet': '下载历史记录（Parquet）',
+        'archive_before': '归档此日期之前的记录',
+        'archive_records': '移入归档',
+        'confirm_archive': '我确认把 {date} 之前的 {total} 条记录移入归档',
+        'records_archived': '已归档 {count} 条记录到 {path}',
+        'invalid_value': '请输入有效的数字值：{feat}',
+        'out_of_range_value': '{feat} 超出合理范围 {low:g}–{high:g} {unit}',
+        'missing_required': '{feat} 为必填项',
+        'missing_as_zero': '以下空白指标按 0 评估：{features}',
+        'fix_inputs': '请先修正标出的指标再评估',
+        'rescore_history': '用当前模型重新评估历史记录',
+        'rescore_start': '开始 / 继续重新评估',
+        'rescore_cancel': '暂停重新评估',
+        'rescore_progress': '已重新评估',
+        'rescore_done': '重新评估完成：模型 {version} 已评估 {done} 条记录',
+        'rescore_cancelled': '重新评估已暂停（{done}/{total}），再次开始会从中断处继续',
+        'rescore_failed': '重新评估失败',
+        'cohort_shap': '群体解释',
+        'cohort_shap_start': '计算 / 更新群体 SHAP',
+        'cohort_shap_cancel': '暂停',
+        'cohort_shap_progress': '已解释',
+        'cohort_shap_done': '群体 SHAP 已更新：模型 {version} 已解释 {done} 条记录',
+        'cohort_shap_cancelled': '群体 SHAP 已暂停（{done}/{total}），再次开始会从中断处继续',
+        'cohort_shap_failed': '群体 SHAP 计算失败',
+        'cohort_shap_empty': '尚未计算群体 SHAP',
+        'cohort_shap_summary': '模型 {version} 已解释 {explained} 条记录（图中抽样 {sampled} 条）',
+        'cohort_shap_stale': '结果由模型 {version} 计算，当前模型为 {current}，更新后会重新计算',
+        'cohort_shap_outdated': '上次更新后有记录被删除或归档，更新时会重新计算',
+        'global_importance': '全局重要性（平均 |SHAP|）',
+        'importance_by_band': '各风险等级的平均 |SHAP|',
+        'cohort_band': '风险等级',
+        'shap_summary': 'SHAP 汇总（颜色：指标值由低到高）',
+        'dependence_plot': '依赖图',
+        'dependence_feature': '指标'
     }
 }
 
@@ -149,98 +314,316 @@ def tr(key):
     return translations[st.session_state.language].get(key, key)
 
 
-# 加载模型
-try:
-    model = CatBoostClassifier().load_model(model_path)
-    explainer = joblib.load(explainer_path)
-except Exception as e:
-    st.error(f"模型加载失败: {str(e)}")
-    st.stop()
+model_registry = get_registry(model_path, explainer_path)
+prediction_cache = get_prediction_cache()
+
+
+# 历史记录存储占用的磁盘空间（SQLite 包括 WAL 文件）
+def history_store_bytes():
+    return sum(os.path.getsize(path) for path in (history_path, history_path + "-wal") if os.path.exists(path))
+
+
+# 导出时才计算的指标，同名注册会覆盖，重跑时重复注册没有影响
+metrics_registry = get_metrics()
+metrics_registry.register_collector("dr_prediction_cache_hits_total", "counter", "Prediction cache hits.",
+                                    lambda: prediction_cache.stats()["hits"])
+metrics_registry.register_collector("dr_prediction_cache_misses_total", "counter", "Prediction cache misses.",
+                                    lambda: prediction_cache.stats()["misses"])
+metrics_registry.register_collector("dr_prediction_cache_entries", "gauge", "Prediction cache entries.",
+                                    lambda: prediction_cache.stats()["size"])
+metrics_registry.register_collector("dr_history_records", "gauge", "Records in the history store.",
+                                    lambda: history_store_backend.count())
+metrics_registry.register_collector("dr_history_store_bytes", "gauge", "History store size on disk.",
+                                    history_store_bytes)
+metrics_registry.register_collector("dr_history_write_queue", "gauge", "Records waiting for the history writer.",
+                                    lambda: history_writer.pending)
+metrics_registry.register_collector("dr_history_dropped_records_total", "counter",
+                                    "Records the history writer could not store and moved to quarantine.",
+                                    lambda: history_writer.dropped_records)
+metrics_registry.register_collector("dr_explain_inflight", "gauge", "Explanations being computed in the pool.",
+                                    explain_pool.inflight_count)
+rescore_job = get_rescore_job()
+cohort_shap_job = get_cohort_shap_job()
+# 挑战者模型的影子评估，只记录不显示
+shadow_scorer = get_shadow_scorer()
+metrics_registry.register_collector("dr_shadow_pending", "gauge", "Challenger scoring tasks waiting or running.",
+                                    lambda: shadow_scorer.pending)
+metrics_registry.register_collector("dr_rescore_done_records", "gauge", "Records re-scored by the current job.",
+                                    lambda: rescore_job.progress().get("done", 0))
+metrics_registry.register_collector("dr_cohort_shap_done_records", "gauge", "Records explained by the cohort SHAP job.",
+                                    lambda: cohort_shap_job.progress().get("done", 0))
+start_configured_exporters()
+
+
+# 加载模型（进程内只加载一次，模型文件被替换时自动热加载）
+def load_model_bundle():
+    try:
+        with span("model_load"):
+            bundle = model_registry.get()
+    except Exception as e:
+        st.error(f"模型加载失败: {str(e)}")
+        st.stop()
+    # 评估结果缓存，模型版本变化时自动清空
+    prediction_cache.ensure_version(bundle.version)
+    return bundle
+
+
+if STARTUP_MODE == "eager":
+    load_model_bundle()
+    shadow_scorer.prewarm()
+
+
+# 绘制解释图，返回 (类型, 内容)，便于缓存
+def render_force_plot(expected_value, shap_values, feature_row):
+    if PLOT_RENDERER == "matplotlib":
+        return "png", force_plot_png(expected_value, shap_values, feature_row)
+    renderer = waterfall_svg if PLOT_RENDERER == "waterfall" else force_plot_svg
+    return "svg", renderer(expected_value, shap_values, feature_row.values, list(feature_row.index))
+
+
+# 计算 SHAP 值并绘制解释图；在线程池中运行，不能调用 st.*
+def compute_explanation(explainer, input_df, prob, cache_key):
+    with span("shap"):
+        shap_value = explainer.shap_values(input_df)
+    with span("render_plot"):
+        force_plot = render_force_plot(explainer.expected_value, shap_value[0], input_df.iloc[0])
+    result = {
+        "prob": prob,
+        "shap_value": shap_value,
+        "force_plot": force_plot
+    }
+    prediction_cache.put(cache_key, result)
+    return result
+
+
+# 等待解释结果，超时或失败时显示提示并返回 None
+def wait_explanation(future):
+    try:
+        with span("explain_wait"):
+            return future.result(timeout=explain_pool.EXPLAIN_TIMEOUT)
+    except FutureTimeoutError:
+        st.warning(tr("explain_timeout").format(seconds=explain_pool.EXPLAIN_TIMEOUT))
+    except Exception as e:
+        st.error(f"生成解释图失败: {str(e)}")
+    return None
+
+
+# 显示解释图
+def show_force_plot(plot):
+    kind, content = plot
+    if kind == "png":
+        st.image(content, width="stretch")
+    else:
+        st.markdown(content, unsafe_allow_html=True)
 
 
 # 初始化历史记录文件
 def init_history_file():
+    if history_store.migration_error:
+        st.sidebar.error(f"历史记录迁移到 SQLite 失败，暂时继续使用 CSV: {history_store.migration_error}")
     try:
-        if not os.path.exists(history_path):
-            features = ["Cortisol", "CRP", "Duration", "CysC", "C-P2", "BUN", "APTT", "RBG", "FT3", "ACR"]
-            header = ["Timestamp", "Name", "Gender"] + features + ["Risk_Probability"]
-            with open(history_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(header)
-            # 设置文件权限 (Unix系统)
-            if not is_windows:
-                os.chmod(history_path, 0o644)
-            return True
+        history_store_backend.init()
         return True
     except Exception as e:
         st.sidebar.error(f"初始化历史文件失败: {str(e)}")
         return False
 
 
-# 保存预测记录到CSV
-def save_prediction_record(name, gender, inputs, risk_probability):
+# 保存预测记录（放入后台写入队列）
+def save_prediction_record(name, gender, inputs, risk_probability, model_version=None):
     try:
-        features = ["Cortisol", "CRP", "Duration", "CysC", "C-P2", "BUN", "APTT", "RBG", "FT3", "ACR"]
-        # 获取北京时间
-        beijing_tz = pytz.timezone('Asia/Shanghai')
-        # 获取当前时间，并转换为北京时间
-        beijing_time = datetime.now(beijing_tz)
-        timestamp = beijing_time.strftime("%Y-%m-%d %H:%M:%S")
-
-        record = [timestamp, name, gender] + [inputs[feat] for feat in features] + [risk_probability]
-
-        # 检查文件是否存在，如果不存在则先创建
-        if not os.path.exists(history_path):
-            init_history_file()
+        record = history_store.make_record(name, gender, inputs, risk_probability, model_version=model_version)
+        with span("history_write"):
+            history_writer.submit([record])
+        return True
+    except Exception as e:
+        st.sidebar.error(f"保存记录失败: {str(e)}")
+        return False
 
-        with open(history_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(record)
 
+# 批量保存预测记录，由后台写入线程一次提交全部行
+def save_prediction_records(records_df, model_version=None):
+    try:
+        with span("history_write_batch"):
+            history_writer.submit_frame(records_df, model_version=model_version)
         return True
     except Exception as e:
-        st.sidebar.error(f"保存记录失败: {str(e)}")
+        st.sidebar.error(f"批量保存记录失败: {str(e)}")
         return False
 
 
-# 读取历史记录
-def load_history():
+# 统计历史记录条数
+def count_history():
     try:
-        if os.path.exists(history_path) and os.path.getsize(history_path) > 0:
-            # 尝试不同编码
-            try:
-                history_df = pd.read_csv(history_path)
-            except UnicodeDecodeError:
-                history_df = pd.read_csv(history_path, encoding='latin-1')
-
-            # 检查必要的列是否存在
-            required_columns = ["Timestamp", "Name", "Risk_Probability"]
-            if all(col in history_df.columns for col in required_columns):
-                return history_df
-            else:
-                st.sidebar.warning("历史文件格式不正确，缺少必要列")
-                return pd.DataFrame()
-        else:
-            return pd.DataFrame()
+        with span("history_count"):
+            return history_store_backend.count()
     except Exception as e:
         st.sidebar.error(f"读取历史文件时出错: {str(e)}")
+        return 0
+
+
+# 分页查询历史记录，只读取当前页
+def query_history_page(page, page_size, sort_by, descending, **filters):
+    try:
+        with span("history_query"):
+            return history_store_backend.query_page(page, page_size, sort_by, descending, **filters)
+    except Exception as e:
+        st.sidebar.error(f"查询历史记录时出错: {str(e)}")
+        return pd.DataFrame(), 0
+
+
+# 按前缀联想患者姓名
+def search_history_names(prefix):
+    try:
+        with span("history_search_names"):
+            return history_store_backend.search_names(prefix)
+    except Exception as e:
+        st.sidebar.error(f"查询历史记录时出错: {str(e)}")
+        return []
+
+
+# 每日各风险等级的评估次数（读取增量汇总）
+def load_daily_band_counts(start=None, end=None):
+    try:
+        with span("history_trends"):
+            return history_store_backend.daily_band_counts(start, end)
+    except Exception as e:
+        st.sidebar.error(f"读取趋势汇总时出错: {str(e)}")
+        return pd.DataFrame()
+
+
+# 各风险等级的指标均值（读取增量汇总）
+def load_band_feature_means(start=None, end=None):
+    try:
+        with span("history_trends"):
+            return history_store_backend.band_feature_means(start, end)
+    except Exception as e:
+        st.sidebar.error(f"读取趋势汇总时出错: {str(e)}")
+        return pd.DataFrame()
+
+
+# 某位患者的风险变化趋势
+def load_patient_trajectory(patient_name):
+    try:
+        with span("history_trends"):
+            return history_store_backend.patient_trajectory(patient_name)
+    except Exception as e:
+        st.sidebar.error(f"读取患者趋势时出错: {str(e)}")
         return pd.DataFrame()
 
 
 # 删除选定的记录
 def delete_records(records_to_delete):
-    if os.path.exists(history_path):
-        try:
-            history_df = pd.read_csv(history_path)
-            # 保留不在删除列表中的记录
-            updated_history = history_df[~history_df.index.isin(records_to_delete)]
-            # 保存更新后的记录
-            updated_history.to_csv(history_path, index=False)
-            return True
-        except Exception as e:
-            st.sidebar.error(f"删除记录时出错: {str(e)}")
-            return False
-    return False
+    try:
+        with span("history_delete"):
+            return history_store_backend.delete(records_to_delete)
+    except Exception as e:
+        st.sidebar.error(f"删除记录时出错: {str(e)}")
+        return False
+
+
+# 把截止日期之前的记录移到按月分区的 Parquet 归档，返回归档的条数，失败时返回 None
+def archive_old_records(cutoff):
+    try:
+        with span("history_archive"):
+            return history_store.archive_before(history_store_backend, cutoff)
+    except Exception as e:
+        st.sidebar.error(f"归档记录时出错: {str(e)}")
+        return None
+
+
+# 启动（或从检查点继续）后台重新评估任务，已在运行时返回 False
+def start_rescore():
+    try:
+        return rescore_job.start(history_store_backend, model_registry)
+    except Exception as e:
+        st.sidebar.error(f"启动重新评估时出错: {str(e)}")
+        return False
+
+
+# 启动（或增量更新）后台群体 SHAP 任务，已在运行时返回 False
+def start_cohort_shap():
+    try:
+        return cohort_shap_job.start(history_store_backend, model_registry)
+    except Exception as e:
+        st.sidebar.error(f"启动群体 SHAP 计算时出错: {str(e)}")
+        return False
+
+
+# 读取离线计算的群体 SHAP 汇总和抽样，失败时返回 (None, None)
+def load_cohort_shap():
+    try:
+        return load_cohort_shap_summary()
+    except Exception as e:
+        st.sidebar.error(f"读取群体 SHAP 时出错: {str(e)}")
+        return None, None
+
+
+# 后台任务进度，任务运行时每 2 秒刷新一次；prefix 为翻译键前缀（rescore / cohort_shap）
+def show_job_progress(job, prefix):
+    progress = job.progress()
+    status = progress["status"]
+    done, total = progress.get("done", 0), progress.get("total")
+    if status == "running":
+        text = f"{tr(prefix + '_progress')}: {done}/{total if total is not None else '?'}"
+        if progress.get("rows_per_s"):
+            text += f" · {progress['rows_per_s']:,.0f} rows/s"
+        st.progress(done / total if total else 0.0, text=text)
+    elif status == "done":
+        st.success(tr(prefix + "_done").format(done=done, version=progress.get("model_version")))
+    elif status == "cancelled":
+        st.info(tr(prefix + "_cancelled").format(done=done, total=total))
+    elif status == "failed":
+        st.error(f"{tr(prefix + '_failed')}: {progress.get('error')}")
+
+
+# 群体解释：全局重要性、各风险等级的重要性、蜂群图和依赖图，只读取离线计算的汇总和抽样；
+# current_version 为已加载模型的版本，模型尚未加载时为 None，不提示结果是否过期
+def show_cohort_shap(current_version):
+    state, sample = load_cohort_shap()
+    if state is None or not state.get("explained"):
+        st.info(tr("cohort_shap_empty"))
+        return
+    st.caption(tr("cohort_shap_summary").format(explained=state["explained"], version=state["model_version"],
+                                                sampled=len(sample)))
+    if current_version is not None and state["model_version"] != current_version:
+        st.warning(tr("cohort_shap_stale").format(version=state["model_version"], current=current_version))
+    try:
+        if history_changed(history_store_backend, state):
+            st.warning(tr("cohort_shap_outdated"))
+    except Exception as e:
+        st.sidebar.error(f"检查群体 SHAP 是否过期时出错: {str(e)}")
+
+    importance = global_importance(state)
+    st.markdown(f"**{tr('global_importance')}**")
+    st.bar_chart(importance["all"], horizontal=True, sort="-all")
+    st.markdown(f"**{tr('importance_by_band')}**")
+    st.dataframe(importance.style.format("{:.4f}"), width="stretch")
+
+    if sample.empty:
+        return
+    band_options = {tr("all"): None}
+    band_options.update({tr(b): b for b in RISK_BANDS if b in set(sample["Band"])})
+    band = band_options[st.selectbox(tr("cohort_band"), list(band_options), key="cohort_band")]
+    if band is not None:
+        sample = sample[sample["Band"] == band]
+    st.markdown(f"**{tr('shap_summary')}**")
+    st.markdown(beeswarm_svg(sample[SHAP_COLUMNS].to_numpy(), sample[FEATURES].to_numpy(), FEATURES),
+                unsafe_allow_html=True)
+
+    st.markdown(f"**{tr('dependence_plot')}**")
+    feat = st.selectbox(tr("dependence_feature"), list(importance.index), key="cohort_feature")
+    st.scatter_chart(sample, x=feat, y=f"SHAP_{feat}", color="Band")
+
+
+# 按筛选条件批量删除记录，返回删除的条数，失败时返回 None
+def delete_matching_records(filters):
+    try:
+        with span("history_delete"):
+            return history_store_backend.delete_where(**filters)
+    except Exception as e:
+        st.sidebar.error(f"删除记录时出错: {str(e)}")
+        return None
 
 
 # 初始化历史记录文件
@@ -391,6 +774,9 @@ if not st.session_state.logged_in:
                 st.error(tr("invalid_credentials"))
 
     st.markdown('</div>', unsafe_allow_html=True)
+    # 登录页已经渲染，在后台预加载模型
+    if STARTUP_MODE == "prewarm":
+        model_registry.prewarm()
     st.stop()
 
 # 主应用界面
@@ -445,6 +831,10 @@ with col3:
         st.rerun()
     st.caption(f"{tr('logged_in_as')}: {tr(st.session_state.user_type)}")
 
+if STARTUP_MODE == "prewarm":
+    model_registry.prewarm()
+    shadow_scorer.prewarm()
+
 # 用户信息输入
 with st.sidebar:
     st.header(tr("patient_info"))
@@ -452,63 +842,73 @@ with st.sidebar:
     gender = st.selectbox(tr("gender"), [tr("male"), tr("female"), tr("other")])
 
     st.header(tr("clinical_indicators"))
-    inputs = {}
-    features = ["Cortisol", "CRP", "Duration", "CysC", "C-P2", "BUN", "APTT", "RBG", "FT3", "ACR"]
-    units = {
-        "Cortisol": "μg/L",
-        "CRP": "mg/L",
-        "Duration": "year",
-        "CysC": "mg/L",
-        "C-P2": "ng/ml",
-        "BUN": "mmol/L",
-        "APTT": "s",
-        "RBG": "mmol/L",
-        "FT3": "pmol/L",
-        "ACR": "Urine Protein/Creatinine Ratio"
-    }
+    raw_inputs = {}
+    features = FEATURES
+    units = UNITS
 
     for feat in features:
         # 创建两列布局：输入框和单位
         col1, col2 = st.columns([3, 1])
         
         with col1:
-            # 使用文本输入而不是数字输入，允许空值
-            input_text = st.text_input(feat, value="", key=f"input_{feat}")
-            
-            # 验证输入是否为有效数字
-            if input_text.strip() == "":
-                inputs[feat] = 0.0  # 空输入默认为0.0
-            else:
-                try:
-                    inputs[feat] = float(input_text)
-                except ValueError:
-                    st.error(f"请输入有效的数字值 for {feat}")
-                    inputs[feat] = 0.0
+            # 使用文本输入而不是数字输入，允许空值；合理范围显示在帮助提示中
+            low, high = FEATURE_SCHEMA.ranges[feat]
+            raw_inputs[feat] = st.text_input(feat, value="", key=f"input_{feat}", help=f"{low:g}–{high:g} {units[feat]}")
         
         with col2:
             # 在右侧显示单位
             st.markdown(f'<div style="margin-top: 28px; color: #666; font-size: 12px;">{units[feat]}</div>', unsafe_allow_html=True)
 
+    # 一次校验全部输入：空值按缺失值处理方式填充，无效或超出范围的值标出且不评估
+    validation = FEATURE_SCHEMA.validate_inputs(raw_inputs)
+    inputs = validation.values.iloc[0].to_dict()
+    for i, feat in enumerate(features):
+        low, high = FEATURE_SCHEMA.ranges[feat]
+        if validation.invalid[0, i]:
+            st.error(tr("invalid_value").format(feat=feat))
+        elif validation.out_of_range[0, i]:
+            st.error(tr("out_of_range_value").format(feat=feat, low=low, high=high, unit=units[feat]))
+        elif validation.missing[0, i] and FEATURE_SCHEMA.required[i]:
+            st.error(tr("missing_required").format(feat=feat))
+    missing_as_zero = [feat for i, feat in enumerate(features)
+                       if validation.missing[0, i] and not FEATURE_SCHEMA.required[i]]
+    if missing_as_zero and len(missing_as_zero) < len(features):
+        st.caption(tr("missing_as_zero").format(features=", ".join(missing_as_zero)))
+
 # 预测与解释
 if st.button(tr("start_assessment"), type="primary"):
     if not name:
         st.warning(tr("warning_name"))
+    elif validation.rejected[0]:
+        st.error(tr("fix_inputs"))
     else:
         input_df = pd.DataFrame([inputs])
+        model_bundle = load_model_bundle()
+        model = model_bundle.model
+        explainer = model_bundle.explainer
+
+        # 相同输入和模型版本的结果直接从缓存读取
+        with span("cache_lookup"):
+            cache_key = prediction_cache.key(inputs, model_bundle.version)
+            cached_result = prediction_cache.get(cache_key)
+        metrics_registry.inc("dr_assessments_total", cache="hit" if cached_result is not None else "miss")
 
         # 预测概率
-        prob = model.predict_proba(input_df)[0][1]
+        if cached_result is not None:
+            prob = cached_result["prob"]
+        else:
+            with span("predict"):
+                # 按特征顺序直接传入数值数组，编译引擎不再经过 DataFrame
+                prob = model.predict_proba(np.array([[inputs[feat] for feat in FEATURES]]))[0][1]
+            # 解释在线程池中计算，下面先显示风险概率
+            explanation = explain_pool.submit(cache_key, compute_explanation, explainer, input_df, prob, cache_key)
+        # 挑战者在后台评估同一输入，不影响显示和保存的概率
+        shadow_scorer.submit([[inputs[feat] for feat in FEATURES]], [prob], model_bundle.version, [name])
 
         # 使用颜色编码显示风险水平
-        if prob < 0.3:
-            risk_color = "green"
-            risk_level = tr("low_risk")
-        elif prob < 0.7:
-            risk_color = "orange"
-            risk_level = tr("medium_risk")
-        else:
-            risk_color = "red"
-            risk_level = tr("high_risk")
+        risk_key = get_risk_level(prob)
+        risk_color = RISK_COLORS[risk_key]
+        risk_level = tr(risk_key)
 
         st.markdown(f"""
         <div style="padding: 15px; border-radius: 5px; background-color: #f8f9fa; border-left: 5px solid {risk_color}; margin-bottom: 20px;">
@@ -518,102 +918,301 @@ if st.button(tr("start_assessment"), type="primary"):
         """, unsafe_allow_html=True)
 
         # 保存预测记录
-        if save_prediction_record(name, gender, inputs, prob):
+        if save_prediction_record(name, gender, inputs, prob, model_bundle.version):
             st.info(tr("record_saved"))
         else:
             st.error("保存记录失败，请查看侧边栏的错误信息")
 
-        # SHAP解释
+        # SHAP解释 - 结果就绪后填入占位
         st.subheader(tr("feature_impact"))
-        shap_value = explainer.shap_values(input_df)
-
-        # 绘制Force Plot
-        plt.figure(figsize=(10, 4))
-        shap.force_plot(
-            explainer.expected_value,
-            shap_value[0],
-            input_df.iloc[0],
-            matplotlib=True,
-            show=False
-        )
-        st.pyplot(plt.gcf())
-
-        # 特征重要性表格
-        st.subheader(tr("feature_contribution"))
-        contribution_df = pd.DataFrame({
-            "Feature": features,
-            "SHAP Value": shap_value[0]
-        }).sort_values("SHAP Value", key=abs, ascending=False)
-
+        explain_placeholder = st.empty()
+        if cached_result is not None:
+            explanation_result = cached_result
+        else:
+            with explain_placeholder.container():
+                with st.spinner(tr("explaining")):
+                    explanation_result = wait_explanation(explanation)
+
+        if explanation_result is not None:
+            shap_value = explanation_result["shap_value"]
+            with explain_placeholder.container():
+                with span("display_plot"):
+                    show_force_plot(explanation_result["force_plot"])
+
+                # 特征重要性表格
+                st.subheader(tr("feature_contribution"))
+                contribution_df = pd.DataFrame({
+                    "Feature": features,
+                    "SHAP Value": shap_value[0]
+                }).sort_values("SHAP Value", key=abs, ascending=False)
+
+
+                # 添加颜色编码
+                def color_shap_value(val):
+                    color = 'red' if val > 0 else 'green'
+                    return f'color: {color}'
+
+
+                styled_df = contribution_df.style.applymap(color_shap_value, subset=['SHAP Value'])
+                st.dataframe(styled_df)
+
+# 假设分析 - 固定其余指标，整张网格一次评估并按患者输入缓存，拖动滑块只查表
+if st.toggle(tr("what_if"), key="what_if_enabled"):
+    what_if_features = st.multiselect(tr("what_if_features"), FEATURES, default=["RBG"],
+                                      max_selections=2, key="what_if_features")
+    if what_if_features and validation.rejected[0]:
+        # 与开始评估相同：未通过校验的输入不评估
+        st.error(tr("fix_inputs"))
+    elif what_if_features:
+        model_bundle = load_model_bundle()
+        with span("what_if_grid"):
+            grid = cached_score_grid(model_bundle, inputs, what_if_features)
+
+        # 用滑块选取网格上的点，读取预先算好的概率和 SHAP 值
+        point = []
+        slider_cols = st.columns(len(what_if_features))
+        for col, feat, axis in zip(slider_cols, what_if_features, grid["axes"]):
+            with col:
+                options = [float(f"{v:.4g}") for v in axis]
+                chosen = st.select_slider(f"{feat} ({units[feat]})", options=options,
+                                          value=options[nearest_index(axis, inputs[feat])],
+                                          key=f"what_if_value_{feat}")
+                point.append(options.index(chosen))
+        point = tuple(point)
+        point_prob = grid["prob"][point]
+        st.markdown(f"**{tr('what_if_point')}: "
+                    f"<span style='color: {RISK_COLORS[get_risk_level(point_prob)]}'>{point_prob * 100:.1f}%</span>**",
+                    unsafe_allow_html=True)
+
+        if len(what_if_features) == 1:
+            feat = what_if_features[0]
+            curve_df = pd.DataFrame({
+                tr("risk_probability"): grid["prob"],
+                tr("what_if_shap"): grid["shap"][:, FEATURES.index(feat)]
+            }, index=pd.Index(grid["axes"][0], name=feat))
+            st.caption(tr("what_if_curve"))
+            st.line_chart(curve_df[[tr("risk_probability")]])
+            st.caption(tr("what_if_shap"))
+            st.line_chart(curve_df[[tr("what_if_shap")]])
+        else:
+            x_feat, y_feat = what_if_features
+            st.markdown(heatmap_svg(grid["axes"][0], grid["axes"][1], grid["prob"],
+                                    f"{x_feat} ({units[x_feat]})", f"{y_feat} ({units[y_feat]})",
+                                    marker=(inputs[x_feat], inputs[y_feat])), unsafe_allow_html=True)
+
+        # 所选点的解释图，SHAP 值已随网格批量算出
+        point_row = pd.Series(grid["rows"][point], index=FEATURES)
+        show_force_plot(render_force_plot(model_bundle.explainer.expected_value, grid["shap"][point], point_row))
+
+# 批量评估 - 分块评估上传的患者文件并一次性写入历史记录
+with st.expander(tr("batch_assessment")):
+    uploaded_file = st.file_uploader(tr("batch_upload"), type=["csv", "parquet"], key="batch_file")
+    if uploaded_file is not None and st.button(tr("batch_start"), key="batch_btn"):
+        try:
+            batch_df = read_patient_file(uploaded_file)
+            # 没有姓名列或姓名为空的行按 文件名-行号 命名（历史记录的 Name 不能为空）
+            base_name = os.path.splitext(uploaded_file.name)[0]
+            generated_names = pd.Series([f"{base_name}-{i + 1}" for i in range(len(batch_df))], index=batch_df.index)
+            if "Name" not in batch_df.columns:
+                batch_df["Name"] = generated_names
+            else:
+                names = batch_df["Name"].astype("string").str.strip()
+                batch_df["Name"] = names.mask(names.isna() | (names == ""), generated_names).astype(object)
 
-        # 添加颜色编码
-        def color_shap_value(val):
-            color = 'red' if val > 0 else 'green'
-            return f'color: {color}'
+            progress_bar = st.progress(0.0)
 
+            def update_progress(done, total):
+                progress_bar.progress(done / total, text=f"{tr('batch_progress')}: {done}/{total}")
 
-        styled_df = contribution_df.style.applymap(color_shap_value, subset=['SHAP Value'])
-        st.dataframe(styled_df)
+            model_bundle = load_model_bundle()
+            batch_result, n_invalid = score_batch(model_bundle.model, model_bundle.explainer, batch_df,
+                                                  progress_callback=update_progress)
+        except Exception as e:
+            st.error(f"批量评估失败: {str(e)}")
+        else:
+            # 未通过校验的行没有概率，不保存
+            scored = batch_result[batch_result["Risk_Probability"].notna()]
+            st.success(f"{tr('batch_done')}: {len(scored)}")
+            shadow_scorer.submit(scored[FEATURES].to_numpy(dtype=float), scored["Risk_Probability"],
+                                 model_bundle.version, scored["Name"])
+            if n_invalid:
+                st.warning(f"{n_invalid} {tr('batch_invalid')}")
+            if len(scored) and save_prediction_records(scored, model_bundle.version):
+                st.info(f"{len(scored)} {tr('batch_saved')}")
+
+            st.dataframe(batch_result)
+            st.download_button(
+                label=tr("download_batch"),
+                data=batch_result.to_csv(index=False),
+                file_name="dr_batch_results.csv",
+                mime="text/csv"
+            )
 
 # 历史记录查询 - 仅对调查人员开放
 if st.session_state.user_type == "investigator":
     st.subheader(tr("prediction_history"))
-    history_df = load_history()
+    # 读取前等待本进程排队中的记录提交，刚保存的评估能立即出现在列表中
+    if not history_writer.flush(timeout=2):
+        st.sidebar.warning(f"{history_writer.pending} 条记录仍在写入队列中")
+    if history_writer.dropped_records:
+        st.sidebar.error(f"{history_writer.dropped_records} 条记录无法写入历史记录，已移到 "
+                         f"{history_writer.quarantine_path}: {history_writer.last_dropped_error}")
+    elif history_writer.last_error:
+        st.sidebar.error(f"后台写入历史记录失败，稍后自动重试: {history_writer.last_error}")
+    total_records = count_history()
 
     # 添加调试按钮
+    if st.sidebar.button(tr("startup_report")):
+        st.sidebar.json(startup_profile.report())
+
+    # 热路径耗时面板，开关保持打开，便于切换查看的阶段
+    if st.sidebar.toggle(tr("metrics_panel"), key="show_metrics_panel"):
+        stage_summary = metrics_registry.stage_summary()
+        if stage_summary:
+            st.sidebar.dataframe(pd.DataFrame(stage_summary).set_index("stage").round(2))
+            stage = st.sidebar.selectbox(tr("metrics_stage"), [item["stage"] for item in stage_summary],
+                                         key="metrics_stage")
+            # 最近样本按导出直方图的桶统计
+            samples = np.asarray(metrics_registry.recent_samples(stage))
+            buckets = np.asarray(metrics_registry.buckets)
+            bucket_counts = np.bincount(np.searchsorted(buckets, samples), minlength=len(buckets) + 1)
+            st.sidebar.bar_chart(pd.DataFrame({
+                "le_ms": [f"{upper * 1000:g}" for upper in buckets] + ["+Inf"],
+                "count": bucket_counts
+            }), x="le_ms", y="count", x_label=tr("latency_ms"), sort=False)
+        cache_stats = prediction_cache.stats()
+        st.sidebar.metric(tr("cache_hit_rate"), f"{cache_stats['hit_rate'] * 100:.1f}%",
+                          help=f"hits={cache_stats['hits']} misses={cache_stats['misses']} "
+                               f"size={cache_stats['size']}/{cache_stats['maxsize']}")
+        st.sidebar.metric(tr("history_store_size"),
+                          f"{total_records} / {history_store_bytes() / 1024:.1f} KB")
+        st.sidebar.download_button(tr("download_metrics"), data=metrics_registry.render_prometheus,
+                                   file_name="dr_metrics.prom", mime="text/plain")
+
     if st.sidebar.button(tr("debug_history")):
         st.sidebar.write(f"{tr('history_file_path')}: {history_path}")
         st.sidebar.write(f"{tr('file_exists')}: {os.path.exists(history_path)}")
         if os.path.exists(history_path):
             st.sidebar.write(f"{tr('file_size')}: {os.path.getsize(history_path)} {tr('bytes')}")
             try:
-                with open(history_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                # 只显示最近的记录，避免读取整个历史
+                content = history_store_backend.tail(200).to_csv(index=False)
                 st.sidebar.text_area(tr("file_content"), content, height=200)
             except Exception as e:
                 st.sidebar.error(f"{tr('failed_to_read_file')}: {str(e)}")
 
-    if not history_df.empty:
-        # 添加索引列以便选择
-        history_df_display = history_df.copy()
-        history_df_display['Index'] = history_df_display.index
-
+    if total_records > 0:
         # 创建顶部控制行 - 筛选和下载按钮在同一行
         control_col1, control_col2 = st.columns([3, 1])
 
         with control_col1:
-            # 按姓名筛选
-            names = history_df['Name'].unique()
-            selected_name = st.selectbox(tr("filter_by_name"), [tr("all")] + list(names))
+            # 按姓名前缀筛选，输入时从存储中联想匹配的姓名
+            name_prefix = st.text_input(tr("filter_by_name"), key="history_name_prefix").strip()
+            selected_name = tr("all")
+            if name_prefix:
+                selected_name = st.selectbox(tr("matching_names"),
+                                             [tr("all")] + search_history_names(name_prefix),
+                                             key="history_name_match")
 
         with control_col2:
-            # 提供下载选项 - 放在筛选框同一行
-            csv = history_df_display.drop(columns=['Index']).to_csv(index=False)
+            # 提供下载选项 - 放在筛选框同一行，点击下载时才生成 CSV
             st.download_button(
                 label=tr("download_history"),
-                data=csv,
+                data=history_store_backend.export_csv,
                 file_name="dr_prediction_history.csv",
                 mime="text/csv",
                 use_container_width=True
             )
+            st.download_button(
+                label=tr("download_history_parquet"),
+                data=history_store_backend.export_parquet,
+                file_name="dr_prediction_history.parquet",
+                mime="application/vnd.apache.parquet",
+                use_container_width=True
+            )
 
+        # 日期、风险等级筛选和排序
+        filter_col1, filter_col2, filter_col3, filter_col4 = st.columns(4)
+        with filter_col1:
+            date_range = st.date_input(tr("date_range"), value=[], key="history_date_range")
+        with filter_col2:
+            risk_options = {tr("all"): None, tr("low_risk"): "low_risk",
+                            tr("medium_risk"): "medium_risk", tr("high_risk"): "high_risk"}
+            risk_filter = risk_options[st.selectbox(tr("risk_level"), list(risk_options), key="history_risk_filter")]
+        with filter_col3:
+            sort_by = st.selectbox(tr("sort_by"), history_store.SORT_COLUMNS, key="history_sort_by")
+            descending = st.checkbox(tr("descending"), value=True, key="history_descending")
+        with filter_col4:
+            page_size = st.selectbox(tr("page_size"), [25, 50, 100, 200], index=1, key="history_page_size")
+            page_container = st.container()
+
+        filters = {}
         if selected_name != tr("all"):
-            filtered_history = history_df_display[history_df_display['Name'] == selected_name]
-        else:
-            filtered_history = history_df_display
+            filters["name"] = selected_name
+        elif name_prefix:
+            filters["name_prefix"] = name_prefix
+        if len(date_range) > 0:
+            filters["start"] = date_range[0].strftime("%Y-%m-%d")
+        if len(date_range) > 1:
+            filters["end"] = (date_range[1] + timedelta(days=1)).strftime("%Y-%m-%d")
+        if risk_filter is not None:
+            filters["risk_level"] = risk_filter
+
+        # 只查询当前页；筛选条件变化导致页码越界时回到最后一页
+        page = st.session_state.get("history_page", 1)
+        filtered_history, total_matched = query_history_page(page - 1, page_size, sort_by, descending, **filters)
+        n_pages = max(1, -(-total_matched // page_size))
+        if page > n_pages:
+            page = n_pages
+            st.session_state.history_page = page
+            filtered_history, total_matched = query_history_page(page - 1, page_size, sort_by, descending,
+                                                                 **filters)
+        with page_container:
+            st.number_input(tr("page"), min_value=1, max_value=n_pages, step=1, key="history_page")
 
         # 显示历史记录
-        st.dataframe(filtered_history.sort_values("Timestamp", ascending=False).drop(columns=['Index']))
+        st.dataframe(filtered_history)
+        first = (page - 1) * page_size
+        st.caption(tr("showing_records").format(start=first + 1 if total_matched else 0,
+                                                end=first + len(filtered_history), total=total_matched))
+
+        # 趋势 - 只读取随写入和删除增量维护的汇总，不扫描全部历史
+        st.subheader(tr("trends"))
+        trend_col1, trend_col2 = st.columns(2)
+        with trend_col1:
+            st.caption(tr("daily_band_counts"))
+            daily_counts = load_daily_band_counts(filters.get("start"), filters.get("end"))
+            if not daily_counts.empty:
+                daily_counts.index = pd.to_datetime(daily_counts.index)
+                st.bar_chart(daily_counts.rename(columns=tr))
+        with trend_col2:
+            st.caption(tr("patient_trajectory"))
+            if selected_name != tr("all"):
+                trajectory = load_patient_trajectory(selected_name)
+                if not trajectory.empty:
+                    trajectory.index = pd.to_datetime(trajectory["Timestamp"])
+                    st.line_chart(trajectory[["Risk_Probability"]].rename(columns={"Risk_Probability": tr("risk_probability")}))
+            else:
+                st.info(tr("select_patient_for_trend"))
+        band_means = load_band_feature_means(filters.get("start"), filters.get("end"))
+        if not band_means.empty:
+            st.caption(tr("band_feature_means"))
+            st.dataframe(band_means.rename(index=tr).round(3))
 
         # 删除记录功能
         st.subheader(tr("data_management"))
 
-        # 选择要删除的记录
+        # 选择要删除的记录（当前页），预先生成 编号 -> 标签 的映射
+        record_labels = {
+            record_id: f"Index {record_id}: {record_name} - {record_time}"
+            for record_id, record_name, record_time in zip(filtered_history.index,
+                                                           filtered_history['Name'],
+                                                           filtered_history['Timestamp'])
+        }
         records_to_delete = st.multiselect(
             tr("select_records"),
-            options=filtered_history['Index'].tolist(),
-            format_func=lambda
-                x: f"Index {x}: {filtered_history[filtered_history['Index'] == x]['Name'].iloc[0]} - {filtered_history[filtered_history['Index'] == x]['Timestamp'].iloc[0]}"
+            options=list(record_labels),
+            format_func=record_labels.get
         )
 
         if records_to_delete and st.button(tr("delete_selected"), type="secondary"):
@@ -623,12 +1222,68 @@ if st.session_state.user_type == "investigator":
                 st.rerun()
             else:
                 st.error("Failed to delete records.")
+
+        # 按当前筛选条件批量删除，例如某位患者某日期之前的全部记录，只需一次存储操作
+        if filters and total_matched > 0:
+            confirm_bulk = st.checkbox(tr("confirm_delete_matching").format(total=total_matched),
+                                       key="confirm_bulk_delete")
+            if confirm_bulk and st.button(tr("delete_matching"), type="secondary", key="bulk_delete_btn"):
+                n_deleted = delete_matching_records(filters)
+                if n_deleted is not None:
+                    st.success(tr("records_deleted").format(count=n_deleted))
+                    st.rerun()
+                else:
+                    st.error("Failed to delete records.")
+
+        # 把旧记录移出热数据，按月写入 Parquet 归档
+        archive_col1, archive_col2 = st.columns([3, 1])
+        with archive_col1:
+            # 默认归档一年以前的记录
+            archive_cutoff = st.date_input(tr("archive_before"), value=datetime.now() - timedelta(days=365),
+                                           key="archive_cutoff")
+        archive_end = archive_cutoff.strftime("%Y-%m-%d")
+        with archive_col2:
+            # 与批量删除相同，先确认再显示按钮；提示会移动的条数
+            _, n_to_archive = query_history_page(0, 1, "Timestamp", False, end=archive_end)
+            confirm_archive = n_to_archive > 0 and st.checkbox(
+                tr("confirm_archive").format(total=n_to_archive, date=archive_end), key="confirm_archive")
+            if confirm_archive and st.button(tr("archive_records"), key="archive_btn"):
+                n_archived = archive_old_records(archive_end)
+                if n_archived is not None:
+                    st.success(tr("records_archived").format(count=n_archived, path=history_store.ARCHIVE_DIR))
+                    st.rerun()
+
+        # 用当前模型在后台分批重新评估全部记录，新概率写在原评分旁边
+        st.subheader(tr("rescore_history"))
+        rescore_col1, rescore_col2 = st.columns(2)
+        with rescore_col1:
+            if st.button(tr("rescore_start"), key="rescore_btn", disabled=rescore_job.running):
+                start_rescore()
+        with rescore_col2:
+            if st.button(tr("rescore_cancel"), key="rescore_cancel_btn", disabled=not rescore_job.running):
+                rescore_job.cancel()
+        st.fragment(run_every=2 if rescore_job.running else None)(show_job_progress)(rescore_job, "rescore")
+
+        # 历史记录的 SHAP 在后台离线分批计算并持久化，这里只读取汇总，不在页面上计算
+        st.subheader(tr("cohort_shap"))
+        cohort_col1, cohort_col2 = st.columns(2)
+        with cohort_col1:
+            if st.button(tr("cohort_shap_start"), key="cohort_shap_btn", disabled=cohort_shap_job.running):
+                start_cohort_shap()
+        with cohort_col2:
+            if st.button(tr("cohort_shap_cancel"), key="cohort_shap_cancel_btn",
+                         disabled=not cohort_shap_job.running):
+                cohort_shap_job.cancel()
+        st.fragment(run_every=2 if cohort_shap_job.running else None)(show_job_progress)(cohort_shap_job,
+                                                                                         "cohort_shap")
+        # 不为显示版本号而加载模型（DR_STARTUP_MODE=lazy 时模型在第一次评估时才加载）
+        show_cohort_shap(load_model_bundle().version if model_registry.loaded else None)
     else:
         st.info(tr("no_history"))
         # 提供创建示例数据的选项
         if st.button(tr("create_sample_data")):
             sample_data = {
-                "Timestamp": [datetime.now(pytz.timezone('Asia/Shanghai')).strftime("%Y-%m-%d %H:%M:%S")],
+                "Timestamp": [history_store.beijing_timestamp()],
                 "Name": [tr("sample_patient")],
                 "Gender": ["Male"],
                 "Cortisol": [15.2],
@@ -644,7 +1299,10 @@ if st.session_state.user_type == "investigator":
                 "Risk_Probability": [0.45]
             }
             sample_df = pd.DataFrame(sample_data)
-            sample_df.to_csv(history_path, index=False)
+            history_store_backend.write(sample_df)
             st.rerun()
 else:
     st.info(tr("login_prompt"))
+
+# 整次重跑耗时（登录页等提前 st.stop() 的重跑不计入）
+metrics_registry.observe("rerun", time.perf_counter() - _rerun_start)
@@ -0,0 +1,73 @@
+"""批量评估：读取患者文件，分块调用 predict_proba 和 shap_values"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from feature_schema import FEATURE_SCHEMA
+from features import FEATURES
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def read_patient_file(file, file_name=None):
+    """读取 CSV 或 Parquet 文件，file 可以是路径或上传的文件对象"""
+    file_name = file_name or getattr(file, 'name', None) or str(file)
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return pd.read_parquet(file)
+    try:
+        return pd.read_csv(file)
+    except UnicodeDecodeError:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return pd.read_csv(file, encoding='latin-1')
+
+
+def prepare_features(df):
+    """按模型特征顺序取出特征列并校验，规则与单次评估相同（见 feature_schema）
+
+    返回 feature_schema.ValidationResult，rejected 的行不评估。
+    """
+    return FEATURE_SCHEMA.validate_frame(df)
+
+
+def iter_score_chunks(model, explainer, X, chunk_size=DEFAULT_CHUNK_SIZE):
+    """分块评估，每块只调用一次 predict_proba 和一次 shap_values
+
+    逐块产出 (已完成行数, 总行数, 概率数组, SHAP 矩阵)。
+    """
+    total = len(X)
+    for start in range(0, total, chunk_size):
+        chunk = X.iloc[start:start + chunk_size]
+        probs = model.predict_proba(chunk)[:, 1]
+        shap_values = np.asarray(explainer.shap_values(chunk))
+        yield start + len(chunk), total, probs, shap_values
+
+
+def score_batch(model, explainer, df, chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None):
+    """评估整个文件，返回 (结果表, 未评估的行数)
+
+    结果表包含 Risk_Probability、各特征 SHAP 值和 Validation_Issues；
+    含无效值、超出范围的值或不允许缺失的空值的行不评估，概率和 SHAP 值为空。
+    """
+    validation = prepare_features(df)
+    accepted = ~validation.rejected
+    X = validation.values[accepted]
+    probs = np.full(len(df), np.nan)
+    shap_matrix = np.full((len(df), len(FEATURES)), np.nan)
+    positions = np.flatnonzero(accepted)
+
+    for done, total, chunk_probs, chunk_shap in iter_score_chunks(model, explainer, X, chunk_size):
+        rows = positions[done - len(chunk_probs):done]
+        probs[rows] = chunk_probs
+        shap_matrix[rows] = chunk_shap
+        if progress_callback is not None:
+            progress_callback(done, total)
+
+    result = df.drop(columns=FEATURES).copy()
+    result[FEATURES] = validation.values
+    result["Risk_Probability"] = probs
+    result["Validation_Issues"] = FEATURE_SCHEMA.issues(validation)
+    shap_df = pd.DataFrame(shap_matrix, columns=[f"SHAP_{feat}" for feat in FEATURES], index=result.index)
+    return pd.concat([result, shap_df], axis=1), int(validation.rejected.sum())
@@ -0,0 +1,245 @@
+"""预测、解释和历史记录路径的基准测试
+
+直接调用界面使用的同一批函数（模型注册表、解释器、渲染、历史记录存储），
+输出每项的 p50/p99 延迟、吞吐量和内存（RSS），结果为 JSON。
+peak_rss_mb 为该项测量期间的峰值（Linux 上测量前通过 /proc/self/clear_refs 重置），
+不包含之前运行的测量；不支持重置的平台上为 None，只能参考 process_peak_rss_mb（整个进程的峰值）。
+
+用法:
+    python bench.py --sizes 1000,100000,1000000 --backend both --output bench.json
+    python bench.py --baseline bench.json --tolerance 0.2   # 与基线比较，p50 变慢超过 20% 时返回 1
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import history_store
+from explain import sample_inputs
+from features import FEATURES
+from model_registry import get_registry
+from render import force_plot_svg, force_plot_png
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def process_peak_rss_mb():
+    """进程启动以来的峰值内存，包含之前的全部操作"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """当前常驻内存；没有 /proc 的平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """把峰值内存（VmHWM）重置为当前值（Linux 4.0+），成功返回 True"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """上次 reset_peak_rss 以来的峰值内存，读取失败时返回 None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def percentiles_ms(samples, quantiles=(50, 99)):
+    """延迟样本（秒）的分位数，单位毫秒，例如 {"p50_ms": ..., "p99_ms": ...}"""
+    samples_ms = np.asarray(samples) * 1000
+    return {f"p{q}_ms": float(np.percentile(samples_ms, q)) for q in quantiles}
+
+
+def measure(name, fn, repeats, rows_per_call=1, **params):
+    """重复执行 fn，返回延迟分位数、吞吐量和本项测量（含预热）的内存"""
+    rss_before = current_rss_mb()
+    peak_reset = reset_peak_rss()
+    fn()  # 预热
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    result = dict(
+        name=name,
+        repeats=repeats,
+        rows_per_call=rows_per_call,
+        **percentiles_ms(times),
+        mean_ms=float(np.mean(times) * 1000),
+        throughput_rows_per_s=float(rows_per_call / np.median(times)) if np.median(times) > 0 else None,
+        peak_rss_mb=peak_rss_mb() if peak_reset else None,
+        rss_delta_mb=current_rss_mb() - rss_before if rss_before is not None else None,
+        process_peak_rss_mb=process_peak_rss_mb(),
+        **params
+    )
+    print(f"{name} {params or ''}: p50={result['p50_ms']:.3f}ms p99={result['p99_ms']:.3f}ms",
+          file=sys.stderr)
+    return result
+
+
+def bench_model(repeats, batch_sizes, with_matplotlib):
+    bundle = get_registry().get()
+    model, explainer = bundle.model, bundle.explainer
+    X = sample_inputs(model, max(batch_sizes + [repeats]))
+    row = X.iloc[[0]]
+    results = [
+        measure("predict_proba", lambda: model.predict_proba(row), repeats, rows=1),
+        measure("shap_values", lambda: explainer.shap_values(row), repeats, rows=1),
+    ]
+    for n in batch_sizes:
+        batch = X.iloc[:n]
+        batch_repeats = max(3, repeats // 10)
+        results.append(measure("predict_proba", lambda: model.predict_proba(batch), batch_repeats, n, rows=n))
+        results.append(measure("shap_values", lambda: explainer.shap_values(batch), batch_repeats, n, rows=n))
+
+    shap_row = np.asarray(explainer.shap_values(row))[0]
+    results.append(measure("render_force_plot", lambda: force_plot_svg(
+        explainer.expected_value, shap_row, row.iloc[0].values, FEATURES), repeats, renderer="svg"))
+    if with_matplotlib:
+        results.append(measure("render_force_plot", lambda: force_plot_png(
+            explainer.expected_value, shap_row, row.iloc[0]), max(3, repeats // 10), renderer="matplotlib"))
+    return results, bundle
+
+
+def synthetic_history(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01")
+    timestamps = start + pd.to_timedelta(np.sort(rng.integers(0, 365 * 24 * 3600, n_rows)), unit="s")
+    history_df = pd.DataFrame({
+        "Timestamp": timestamps.strftime("%Y-%m-%d %H:%M:%S"),
+        "Name": [f"patient-{i}" for i in rng.integers(0, max(1, n_rows // 5), n_rows)],
+        "Gender": rng.choice(["Male", "Female"], n_rows),
+    })
+    for feat in FEATURES:
+        history_df[feat] = rng.uniform(0, 50, n_rows).round(2)
+    history_df["Risk_Probability"] = rng.random(n_rows)
+    return history_df
+
+
+def make_store(backend, directory):
+    if backend == "csv":
+        return history_store.CsvHistoryStore(os.path.join(directory, "history.csv"))
+    return history_store.SqliteHistoryStore(os.path.join(directory, "history.db"))
+
+
+def bench_history(backend, n_rows, repeats):
+    # 大表上的全量操作次数相应减少
+    heavy_repeats = max(3, min(repeats, 100_000 // n_rows * 3))
+    record = history_store.make_record("bench", "Male", {feat: 1.0 for feat in FEATURES}, 0.5)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(backend, directory)
+        store.write(synthetic_history(n_rows))
+        params = dict(backend=backend, history_rows=n_rows)
+
+        results.append(measure("save_prediction_record", lambda: store.append_records([record]), repeats, **params))
+        results.append(measure("load_history", store.load, heavy_repeats, n_rows, cached=False, **params))
+
+        def append_then_load_cached():
+            store.append_records([record])
+            store.load_cached()
+        store.load_cached()
+        results.append(measure("load_history", append_then_load_cached, repeats, 1, cached=True, **params))
+        results.append(measure("query_page", lambda: store.query_page(page=0, page_size=50), repeats,
+                               50, **params))
+
+        def delete_last():
+            store.delete([int(store.tail(1).index[-1])])
+        results.append(measure("delete_records", delete_last, heavy_repeats, 1, **params))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较 p50，返回变慢超过容差的项目"""
+    def key(item):
+        return json.dumps({k: v for k, v in item.items()
+                           if k in ("name", "rows", "renderer", "backend", "history_rows", "cached")}, sort_keys=True)
+
+    base = {key(item): item for item in baseline["results"]}
+    regressions = []
+    for item in results:
+        ref = base.get(key(item))
+        if ref and item["p50_ms"] > ref["p50_ms"] * (1 + tolerance):
+            regressions.append({"benchmark": json.loads(key(item)),
+                                "baseline_p50_ms": ref["p50_ms"], "p50_ms": item["p50_ms"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DR 预测系统基准测试")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="历史记录行数，逗号分隔")
+    parser.add_argument("--backend", choices=["sqlite", "csv", "both"], default="both")
+    parser.add_argument("--batch-sizes", default="1000,10000")
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--skip-model", action="store_true")
+    parser.add_argument("--skip-history", action="store_true")
+    parser.add_argument("--with-matplotlib", action="store_true", help="同时测试 matplotlib 后备渲染")
+    parser.add_argument("--output", help="结果写入的 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--baseline", help="用于比较的基线 JSON 文件")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    if not args.skip_model:
+        model_results, bundle = bench_model(args.repeats, [int(n) for n in args.batch_sizes.split(",")],
+                                            args.with_matplotlib)
+        results += model_results
+        meta["model_version"] = bundle.version
+        meta["explainer"] = type(bundle.explainer).__name__
+    if not args.skip_history:
+        backends = ["sqlite", "csv"] if args.backend == "both" else [args.backend]
+        for n_rows in [int(n) for n in args.sizes.split(",")]:
+            for backend in backends:
+                results += bench_history(backend, n_rows, args.repeats)
+
+    report = {"meta": meta, "results": results}
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(results, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
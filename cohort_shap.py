@@ -0,0 +1,222 @@
+"""群体 SHAP 汇总
+
+按主键顺序分批读取历史记录的特征列，整批调用一次 explainer.shap_values，
+每批结果写成一个 Parquet 分片（cohort_shap/<模型版本>/part-<起始编号>.parquet），同时累加:
+- 各风险等级的记录数与 |SHAP| 之和（全局重要性 = 平均 |SHAP|）
+- 底部 k 抽样：每行一个随机键，保留键最小的 SAMPLE_SIZE 行，供蜂群图和依赖图使用
+
+汇总和抽样随检查点一起保存（state.json / sample.parquet），界面只读取这两个小文件，
+不在页面加载时计算 SHAP。任务是增量的：再次运行只处理新增的记录。模型版本变化，或者已处理
+范围内的记录被删除、归档（CSV 删除后行号前移）时，清空目录从头计算，汇总、抽样和分片中
+不会保留已删除的记录。风险等级按当前模型的概率划分，与 SHAP 值一致。
+
+用法: python cohort_shap.py --chunk-size 20000
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_schema import FEATURE_SCHEMA
+from features import FEATURES
+from history_aggregates import RISK_BANDS, risk_bands
+from history_store import HISTORY_DIR
+from metrics import span
+from history_jobs import HistoryJob, history_changed, row_key
+
+COHORT_DIR = os.path.join(HISTORY_DIR, "cohort_shap")
+DEFAULT_CHUNK_SIZE = int(os.environ.get("DR_COHORT_SHAP_CHUNK_SIZE", 20000))
+# 蜂群图和依赖图使用的抽样行数
+SAMPLE_SIZE = 5000
+
+SHAP_COLUMNS = [f"SHAP_{feat}" for feat in FEATURES]
+
+
+def _state_path(directory):
+    return os.path.join(directory, "state.json")
+
+
+def _sample_path(directory):
+    return os.path.join(directory, "sample.parquet")
+
+
+def load_state(directory=COHORT_DIR):
+    try:
+        with open(_state_path(directory), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _new_state(version):
+    zeros = [0.0] * len(FEATURES)
+    return {
+        "model_version": version, "last_id": -1, "last_row": None, "done": 0, "explained": 0, "status": "running",
+        "started_at": time.time(),
+        "bands": {band: {"n": 0, "abs_shap_sum": list(zeros)} for band in RISK_BANDS}
+    }
+
+
+def _save(directory, state, sample):
+    # 先写抽样，最后替换 state.json；中断时检查点和抽样不会错位
+    sample.to_parquet(_sample_path(directory) + ".tmp", index=False)
+    os.replace(_sample_path(directory) + ".tmp", _sample_path(directory))
+    with open(_state_path(directory) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(_state_path(directory) + ".tmp", _state_path(directory))
+
+
+def explain_chunk(bundle, chunk, rng):
+    """对一批历史记录计算概率、风险等级和 SHAP 值；未通过特征校验的行跳过"""
+    validation = FEATURE_SCHEMA.validate_frame(chunk)
+    accepted = ~validation.rejected
+    X = validation.values[accepted]
+    part = X.copy()
+    part.insert(0, "History_Id", X.index.to_numpy(dtype=np.int64))
+    if X.empty:
+        return part.assign(Risk_Probability=[], Band=[], Sample_Key=[], **dict.fromkeys(SHAP_COLUMNS, []))
+    probs = bundle.model.predict_proba(X.to_numpy())[:, 1]
+    shap_values = np.asarray(bundle.explainer.shap_values(X))
+    part["Risk_Probability"] = probs
+    part["Band"] = risk_bands(probs)
+    part[SHAP_COLUMNS] = shap_values
+    part["Sample_Key"] = rng.random(len(part))
+    return part
+
+
+def run_cohort_shap(store, bundle, chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, cancel_event=None,
+                    directory=COHORT_DIR):
+    """增量计算（或继续计算）群体 SHAP，返回最终进度"""
+    state = load_state(directory)
+    if state is None or state.get("model_version") != bundle.version or history_changed(store, state):
+        # 换了模型（旧的 SHAP 值不再适用）或有记录被删除：从头计算
+        shutil.rmtree(directory, ignore_errors=True)
+        state = _new_state(bundle.version)
+        sample = None
+    else:
+        state["status"] = "running"
+        sample = pd.read_parquet(_sample_path(directory)) if os.path.exists(_sample_path(directory)) else None
+    parts_dir = os.path.join(directory, bundle.version)
+    os.makedirs(parts_dir, exist_ok=True)
+    rng = np.random.default_rng()
+    total = state["done"] + store.count_after(state["last_id"])
+    start = time.perf_counter()
+    processed = 0
+
+    def report(**extra):
+        elapsed = time.perf_counter() - start
+        progress = dict(model_version=bundle.version, done=state["done"], total=total,
+                        rows_per_s=processed / elapsed if elapsed > 0 else None, **extra)
+        if progress_callback is not None:
+            progress_callback(**progress)
+        return progress
+
+    report(status="running")
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            state["status"] = "cancelled"
+            _save(directory, state, sample if sample is not None else pd.DataFrame())
+            return report(status="cancelled")
+        chunk = store.feature_chunk(state["last_id"], chunk_size)
+        if chunk.empty:
+            break
+        with span("cohort_shap_chunk"):
+            part = explain_chunk(bundle, chunk, rng)
+            if not part.empty:
+                part.to_parquet(os.path.join(parts_dir, f"part-{int(chunk.index[0]):012d}.parquet"), index=False)
+                for band, rows in part.groupby("Band"):
+                    totals = state["bands"][band]
+                    totals["n"] += len(rows)
+                    totals["abs_shap_sum"] = (np.asarray(totals["abs_shap_sum"]) +
+                                              rows[SHAP_COLUMNS].abs().sum().to_numpy()).tolist()
+                sample = part if sample is None or sample.empty else pd.concat([sample, part], ignore_index=True)
+                sample = sample.nsmallest(SAMPLE_SIZE, "Sample_Key")
+        state["last_id"] = int(chunk.index[-1])
+        state["last_row"] = row_key(chunk)
+        state["done"] += len(chunk)
+        state["explained"] += len(part)
+        processed += len(chunk)
+        _save(directory, state, sample if sample is not None else pd.DataFrame())
+        report(status="running")
+
+    state["status"] = "done"
+    state["finished_at"] = time.time()
+    _save(directory, state, sample if sample is not None else pd.DataFrame())
+    return report(status="done")
+
+
+_summary_cache = {}
+_summary_lock = threading.Lock()
+
+
+def load_summary(directory=COHORT_DIR):
+    """返回 (state, 抽样 DataFrame)；state.json 未变化时直接返回进程内缓存，尚未计算时返回 (None, None)"""
+    try:
+        key = os.stat(_state_path(directory)).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+    with _summary_lock:
+        cached = _summary_cache.get(directory)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+    state = load_state(directory)
+    try:
+        sample = pd.read_parquet(_sample_path(directory))
+    except (FileNotFoundError, ValueError):
+        sample = pd.DataFrame()
+    with _summary_lock:
+        _summary_cache[directory] = (key, state, sample)
+    return state, sample
+
+
+def global_importance(state):
+    """各特征的平均 |SHAP|，列为 all 和各风险等级，按 all 降序"""
+    columns = {}
+    total_n = 0
+    total_abs = np.zeros(len(FEATURES))
+    for band in RISK_BANDS:
+        totals = state["bands"][band]
+        if totals["n"]:
+            columns[band] = np.asarray(totals["abs_shap_sum"]) / totals["n"]
+            total_n += totals["n"]
+            total_abs += np.asarray(totals["abs_shap_sum"])
+    importance = pd.DataFrame(columns, index=FEATURES)
+    importance.insert(0, "all", total_abs / total_n if total_n else np.nan)
+    return importance.sort_values("all", ascending=False)
+
+
+_job = HistoryJob(run_cohort_shap, DEFAULT_CHUNK_SIZE)
+
+
+def get_cohort_shap_job():
+    return _job
+
+
+def main():
+    import argparse
+
+    import history_store
+    from model_registry import get_registry
+
+    parser = argparse.ArgumentParser(description="增量计算历史记录的群体 SHAP 汇总")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--directory", default=COHORT_DIR)
+    args = parser.parse_args()
+
+    def print_progress(**progress):
+        print(f"{progress['status']}: {progress['done']}/{progress['total']}", flush=True)
+
+    result = run_cohort_shap(history_store.get_store(), get_registry().get(), args.chunk_size, print_progress,
+                             directory=args.directory)
+    state, _ = load_summary(args.directory)
+    importance = global_importance(state)
+    print(json.dumps({"result": result, "mean_abs_shap": {band: importance[band].round(6).to_dict()
+                                                          for band in importance.columns}}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
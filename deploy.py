@@ -0,0 +1,95 @@
+"""多进程部署：在同一台机器上启动多个 Streamlit 工作进程，放在负载均衡之后
+
+各工作进程共用:
+- 内存映射的模型产物（DR_MODEL_SHARED_DIR），启动前由本进程生成一次，工作进程只读映射
+- 同一个历史记录目录和后端（DR_HISTORY_DIR / DR_HISTORY_BACKEND），
+  每个进程的写入线程按 DR_HISTORY_FLUSH_MS 攒批后提交
+
+历史记录目录应放在持久卷上，否则容器重启后记录丢失；多进程并发写入建议使用 SQLite 后端。
+
+用法: python deploy.py --workers 4 --base-port 8501 --history-dir /data/dr_history
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app3.py")
+
+
+def worker_env(args):
+    env = dict(os.environ)
+    env.update({
+        "DR_HISTORY_DIR": args.history_dir,
+        "DR_HISTORY_BACKEND": args.backend,
+        "DR_HISTORY_FLUSH_MS": str(args.flush_ms),
+        "DR_MODEL_SHARED_DIR": args.shared_model_dir,
+        # 模型在启动前已准备好，工作进程直接加载
+        "DR_STARTUP_MODE": env.get("DR_STARTUP_MODE", "eager")
+    })
+    return env
+
+
+def prepare(env):
+    """生成共享模型产物并初始化历史记录存储（建表、迁移），避免各工作进程同时执行"""
+    os.environ.update(env)
+    import history_store
+    from model_registry import get_registry
+
+    bundle = get_registry().get()
+    history_store.get_store().init()
+    return bundle.version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动多个共享模型和历史记录的 Streamlit 工作进程")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--base-port", type=int, default=8501)
+    parser.add_argument("--address", default="0.0.0.0")
+    parser.add_argument("--history-dir", default=os.environ.get("DR_HISTORY_DIR", "/tmp/history"))
+    parser.add_argument("--backend", default=os.environ.get("DR_HISTORY_BACKEND", "sqlite"), choices=["sqlite", "csv"])
+    parser.add_argument("--flush-ms", type=float, default=float(os.environ.get("DR_HISTORY_FLUSH_MS", 200)))
+    parser.add_argument("--shared-model-dir", default=os.environ.get(
+        "DR_MODEL_SHARED_DIR", "/dev/shm/dr_model" if os.path.isdir("/dev/shm") else "/tmp/dr_model"))
+    args = parser.parse_args()
+
+    env = worker_env(args)
+    version = prepare(env)
+    print(f"model {version} shared under {args.shared_model_dir}; history: {args.backend} in {args.history_dir}",
+          flush=True)
+
+    workers = []
+    for i in range(args.workers):
+        port = args.base_port + i
+        workers.append(subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.port", str(port),
+             "--server.address", args.address, "--server.headless", "true"],
+            env=env
+        ))
+        print(f"worker {i} pid={workers[-1].pid} port={port}", flush=True)
+
+    def stop(*_):
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        # 任一工作进程退出时停止全部，交给外部的进程管理器重启
+        while all(worker.poll() is None for worker in workers):
+            time.sleep(1)
+    finally:
+        stop()
+        for worker in workers:
+            try:
+                worker.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+    return max(worker.returncode or 0 for worker in workers)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
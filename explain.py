@@ -0,0 +1,134 @@
+"""SHAP 解释引擎
+
+NativeExplainer 直接调用 CatBoost 自带的精确 TreeSHAP
+（get_feature_importance(type='ShapValues')），接口与 shap.TreeExplainer 保持一致，
+不再需要反序列化 1.1 MB 的 explainer.shap。
+
+运行 python explain.py 可以检查两种引擎的一致性并比较延迟，结果以 JSON 输出。
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from catboost import Pool
+
+from features import FEATURES
+
+
+def _to_frame(X):
+    if isinstance(X, pd.DataFrame):
+        return X[FEATURES]
+    return pd.DataFrame(np.atleast_2d(X), columns=FEATURES)
+
+
+class NativeExplainer:
+    """基于 CatBoost ShapValues 的解释器，提供 expected_value 和 shap_values(X)"""
+
+    def __init__(self, model):
+        self.model = model
+        # 返回矩阵的最后一列是基准值，对所有样本相同
+        base = self._raw_shap(np.zeros((1, len(FEATURES))))[0, -1]
+        self.expected_value = np.array([base])
+
+    def _raw_shap(self, X):
+        return self.model.get_feature_importance(type='ShapValues', data=Pool(_to_frame(X)))
+
+    def shap_values(self, X):
+        """返回 (样本数, 特征数) 的 SHAP 值矩阵（对数几率空间）"""
+        return self._raw_shap(X)[:, :-1]
+
+
+def sample_inputs(model, n_rows, seed=0):
+    """在模型各特征的分裂边界范围内均匀采样，用于一致性检查和基准测试"""
+    rng = np.random.default_rng(seed)
+    borders = model.get_borders()
+    columns = {}
+    for i, feat in enumerate(FEATURES):
+        feat_borders = borders.get(i) or [0.0, 1.0]
+        low, high = min(feat_borders), max(feat_borders)
+        margin = (high - low) * 0.1 or 1.0
+        columns[feat] = rng.uniform(low - margin, high + margin, n_rows)
+    return pd.DataFrame(columns)
+
+
+def check_parity(reference, candidate, X, atol=1e-6):
+    """比较两个解释器的 expected_value 和逐特征 SHAP 值"""
+    ref_values = np.asarray(reference.shap_values(X))
+    cand_values = np.asarray(candidate.shap_values(X))
+    expected_diff = float(abs(np.ravel(reference.expected_value)[0] - np.ravel(candidate.expected_value)[0]))
+    per_feature = np.abs(ref_values - cand_values).max(axis=0)
+    return {
+        "rows": len(X),
+        "expected_value_diff": expected_diff,
+        "max_abs_diff": float(per_feature.max()),
+        "max_abs_diff_per_feature": dict(zip(FEATURES, per_feature.tolist())),
+        "ok": bool(expected_diff <= atol and per_feature.max() <= atol)
+    }
+
+
+def benchmark(explainers, X, repeats=50, batch_size=1000):
+    """比较各解释器单行和批量计算的延迟"""
+    # bench 在模块级导入了本模块，这里延迟导入
+    from bench import percentiles_ms
+
+    results = {}
+    batch = X.iloc[:batch_size]
+    for name, explainer in explainers.items():
+        single = []
+        for i in range(repeats):
+            row = X.iloc[[i % len(X)]]
+            start = time.perf_counter()
+            explainer.shap_values(row)
+            single.append(time.perf_counter() - start)
+
+        batch_times = []
+        for _ in range(max(1, repeats // 10)):
+            start = time.perf_counter()
+            explainer.shap_values(batch)
+            batch_times.append(time.perf_counter() - start)
+
+        results[name] = {
+            "single_row": percentiles_ms(single),
+            "batch": dict(percentiles_ms(batch_times), rows=len(batch),
+                          rows_per_s=float(len(batch) / np.median(batch_times)))
+        }
+    return results
+
+
+def main():
+    import argparse
+
+    import joblib
+    from catboost import CatBoostClassifier
+
+    from model_registry import DEFAULT_MODEL_PATH, DEFAULT_EXPLAINER_PATH
+
+    parser = argparse.ArgumentParser(description="比较 pickle 与 native 两种 SHAP 引擎")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--explainer", default=DEFAULT_EXPLAINER_PATH)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    model = CatBoostClassifier().load_model(args.model)
+
+    start = time.perf_counter()
+    pickled = joblib.load(args.explainer)
+    pickle_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    native = NativeExplainer(model)
+    native_load = time.perf_counter() - start
+
+    X = sample_inputs(model, args.rows)
+    report = {
+        "load_ms": {"pickle": pickle_load * 1000, "native": native_load * 1000},
+        "parity": check_parity(pickled, native, X),
+        "latency": benchmark({"pickle": pickled, "native": native}, X, args.repeats, args.rows)
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
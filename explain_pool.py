@@ -0,0 +1,51 @@
+"""解释计算线程池
+
+风险概率算出后立即显示，SHAP 值和解释图提交到这里的线程池计算，界面先显示占位，
+结果就绪后再填入。同一输入重复提交（例如连续点击）时复用正在进行的任务。
+
+DR_EXPLAIN_WORKERS   线程数，默认 2
+DR_EXPLAIN_TIMEOUT   界面等待解释结果的最长秒数，默认 30；超时后任务继续在后台完成并写入缓存
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+EXPLAIN_WORKERS = int(os.environ.get("DR_EXPLAIN_WORKERS", 2))
+EXPLAIN_TIMEOUT = float(os.environ.get("DR_EXPLAIN_TIMEOUT", 30))
+
+_executor = None
+_inflight = {}
+_lock = threading.Lock()
+
+
+def get_executor():
+    """返回进程内共享的线程池"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPLAIN_WORKERS, thread_name_prefix="explain")
+        return _executor
+
+
+def submit(key, fn, *args, **kwargs):
+    """提交解释任务并返回 Future；key 相同且尚未完成的任务直接复用"""
+    executor = get_executor()
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = executor.submit(fn, *args, **kwargs)
+        _inflight[key] = future
+
+    def done(_):
+        with _lock:
+            if _inflight.get(key) is future:
+                del _inflight[key]
+
+    future.add_done_callback(done)
+    return future
+
+
+def inflight_count():
+    with _lock:
+        return len(_inflight)
@@ -0,0 +1,105 @@
+"""特征校验：由 features.FEATURE_SPECS 编译出取值范围和缺失值处理的数组，
+对单次输入（字典）或整张表（DataFrame）一次完成类型转换和校验。
+
+单次评估、批量评估、HTTP 服务和重新评估共用同一份规则：
+- 空值按各特征的缺失值处理方式填充（zero）或拒绝（reject）
+- 无法解析为数字的值、超出取值范围的值被标记，所在行不评估，不再悄悄按 0 处理
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_SPECS
+
+# values: 按 FEATURES 排列的浮点 DataFrame（已按缺失值处理方式填充）
+# missing / invalid / out_of_range: (行数, 特征数) 的布尔数组
+# rejected: 不能评估的行
+ValidationResult = namedtuple("ValidationResult", ["values", "missing", "invalid", "out_of_range", "rejected"])
+
+
+class FeatureSchema:
+    def __init__(self, specs):
+        for spec in specs:
+            if spec.missing not in ("zero", "reject"):
+                raise ValueError(f"未知的缺失值处理方式: {spec.name}={spec.missing}")
+        self.specs = list(specs)
+        self.features = [spec.name for spec in specs]
+        self.units = {spec.name: spec.unit for spec in specs}
+        self.ranges = {spec.name: (spec.min, spec.max) for spec in specs}
+        self._lows = np.array([spec.min for spec in specs], dtype=float)
+        self._highs = np.array([spec.max for spec in specs], dtype=float)
+        self._fill_zero = np.array([spec.missing == "zero" for spec in specs])
+        # 缺失时不能评估的特征
+        self.required = ~self._fill_zero
+
+    def _check(self, values, missing, index=None):
+        """values 为 (行数, 特征数) 的浮点数组，无法解析的值为 NaN"""
+        invalid = np.isnan(values) & ~missing
+        with np.errstate(invalid="ignore"):
+            out_of_range = (values < self._lows) | (values > self._highs)
+        values = np.where(missing & self._fill_zero, 0.0, values)
+        rejected = (invalid | out_of_range | (missing & self.required)).any(axis=1)
+        return ValidationResult(pd.DataFrame(values, columns=self.features, index=index),
+                                missing, invalid, out_of_range, rejected)
+
+    def _raw(self, df):
+        absent = [feat for feat in self.features if feat not in df.columns]
+        if absent:
+            raise ValueError(f"缺少特征列: {', '.join(absent)}")
+        return df[self.features]
+
+    @staticmethod
+    def _is_numeric(raw):
+        return all(pd.api.types.is_numeric_dtype(dtype) for dtype in raw.dtypes)
+
+    def coerce_frame(self, df):
+        """只做类型转换：特征列转为浮点数，无法解析的值为 NaN，不填充、不校验"""
+        raw = self._raw(df)
+        if self._is_numeric(raw):
+            return raw.astype(float)
+        return raw.apply(pd.to_numeric, errors="coerce").astype(float)
+
+    def validate_frame(self, df):
+        """校验整张表的特征列，缺少特征列时抛出 ValueError"""
+        raw = self._raw(df)
+        values = self.coerce_frame(raw).to_numpy()
+        if self._is_numeric(raw):
+            missing = np.isnan(values)
+        else:
+            # 文本列（例如 CSV 中混有空格）空白字符串视为缺失
+            missing = (raw.isna() | raw.apply(lambda col: col.astype(str).str.strip() == "")).to_numpy()
+        return self._check(values, missing, df.index)
+
+    def validate_inputs(self, inputs):
+        """校验一次评估的输入（特征名 -> 数字或文本），缺少的特征视为缺失"""
+        values = np.full((1, len(self.features)), np.nan)
+        missing = np.zeros((1, len(self.features)), dtype=bool)
+        for i, feat in enumerate(self.features):
+            value = inputs.get(feat)
+            if value is None or (isinstance(value, str) and not value.strip()):
+                missing[0, i] = True
+                continue
+            try:
+                values[0, i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return self._check(values, missing)
+
+    def issues(self, result):
+        """每行的问题列表，例如 "CRP:out_of_range; RBG:invalid"，没有问题的行为空字符串"""
+        labels = np.full(len(result.rejected), "", dtype=object)
+        for kind, mask in [("invalid", result.invalid), ("out_of_range", result.out_of_range),
+                           ("missing", result.missing & self.required)]:
+            for i in np.flatnonzero(mask.any(axis=0)):
+                rows = mask[:, i]
+                labels[rows] = labels[rows] + f"{self.features[i]}:{kind}; "
+        return pd.Series([label.rstrip("; ") for label in labels], index=result.values.index, dtype=object)
+
+    def describe(self):
+        """供 /schema 接口返回的特征定义"""
+        return [{"name": spec.name, "unit": spec.unit, "min": spec.min, "max": spec.max, "missing": spec.missing}
+                for spec in self.specs]
+
+
+FEATURE_SCHEMA = FeatureSchema(FEATURE_SPECS)
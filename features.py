@@ -0,0 +1,63 @@
+"""模型输入特征及相关常量，供界面、批量评估等模块共用
+
+FEATURE_SPECS 是特征的声明式定义，FEATURES、UNITS 和 feature_schema 中的向量化校验都由它生成。
+"""
+from collections import namedtuple
+
+# 单位、合理取值范围 [min, max]（超出时提示，不评估）和缺失值处理方式:
+# - zero: 按 0.0 评估（原有行为，模型在缺失的检验项上以 0 编码）
+# - reject: 缺失时不评估
+FeatureSpec = namedtuple("FeatureSpec", ["name", "unit", "min", "max", "missing"])
+
+# 按模型训练时使用的特征顺序排列
+FEATURE_SPECS = [
+    FeatureSpec("Cortisol", "μg/L", 0.0, 2000.0, "zero"),
+    FeatureSpec("CRP", "mg/L", 0.0, 500.0, "zero"),
+    FeatureSpec("Duration", "year", 0.0, 80.0, "zero"),
+    FeatureSpec("CysC", "mg/L", 0.0, 40.0, "zero"),
+    FeatureSpec("C-P2", "ng/ml", 0.0, 50.0, "zero"),
+    FeatureSpec("BUN", "mmol/L", 0.0, 100.0, "zero"),
+    FeatureSpec("APTT", "s", 0.0, 200.0, "zero"),
+    FeatureSpec("RBG", "mmol/L", 0.0, 60.0, "zero"),
+    FeatureSpec("FT3", "pmol/L", 0.0, 50.0, "zero"),
+    FeatureSpec("ACR", "Urine Protein/Creatinine Ratio", 0.0, 100.0, "zero")
+]
+
+FEATURES = [spec.name for spec in FEATURE_SPECS]
+
+UNITS = {spec.name: spec.unit for spec in FEATURE_SPECS}
+
+# 重新评估时写在原评分旁边的列
+RESCORE_COLUMNS = ["Rescore_Probability", "Rescore_Model_Version"]
+
+# 历史记录文件的列顺序；Model_Version 为保存时所用模型的版本
+HISTORY_COLUMNS = ["Timestamp", "Name", "Gender"] + FEATURES + ["Risk_Probability", "Model_Version"] + RESCORE_COLUMNS
+
+# 风险分级阈值：低于 0.3 为低风险，0.3~0.7 为中风险，0.7 及以上为高风险
+RISK_THRESHOLDS = (0.3, 0.7)
+
+# 风险等级（翻译键）与界面显示颜色
+RISK_COLORS = {
+    "low_risk": "green",
+    "medium_risk": "orange",
+    "high_risk": "red"
+}
+
+
+def risk_level(prob):
+    """根据风险概率返回风险等级的翻译键"""
+    if prob < RISK_THRESHOLDS[0]:
+        return "low_risk"
+    elif prob < RISK_THRESHOLDS[1]:
+        return "medium_risk"
+    return "high_risk"
+
+
+def risk_level_range(level):
+    """返回风险等级对应的概率区间 [下限, 上限)，None 表示不设限"""
+    low, high = RISK_THRESHOLDS
+    return {
+        "low_risk": (None, low),
+        "medium_risk": (low, high),
+        "high_risk": (high, None)
+    }[level]
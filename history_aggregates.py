@@ -0,0 +1,120 @@
+"""历史记录的增量汇总
+
+按 (日期, 风险等级) 累计记录数、风险概率之和与各特征之和，趋势图只读取这张汇总表：
+- 每日各风险等级的记录数
+- 各风险等级的特征均值（和 / 记录数）
+
+SQLite 后端由触发器在每次插入和删除时更新汇总表；CSV 后端在内存中维护同样的汇总，
+追加的记录增量累加，文件被整体重写后重新汇总。
+"""
+import numpy as np
+import pandas as pd
+
+from features import FEATURES, RISK_THRESHOLDS
+
+RISK_BANDS = ["low_risk", "medium_risk", "high_risk"]
+# 累加的列；均值 = 和 / n
+SUM_COLUMNS = ["Risk_Probability"] + FEATURES
+AGG_TABLE = "history_daily_band"
+
+
+def risk_bands(probs):
+    """向量化的风险等级，与 features.risk_level 一致"""
+    probs = np.asarray(probs, dtype=float)
+    return np.select([probs < RISK_THRESHOLDS[0], probs < RISK_THRESHOLDS[1]], RISK_BANDS[:2], RISK_BANDS[2])
+
+
+def aggregate_frame(history_df):
+    """把历史记录汇总为以 (Day, Band) 为索引、包含 n 和各列之和的表"""
+    if history_df.empty:
+        return pd.DataFrame(columns=["n"] + SUM_COLUMNS,
+                            index=pd.MultiIndex.from_tuples([], names=["Day", "Band"]))
+    sums = history_df[SUM_COLUMNS].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+    sums["n"] = 1
+    keys = [history_df["Timestamp"].astype(str).str[:10].rename("Day"),
+            pd.Series(risk_bands(history_df["Risk_Probability"]), index=history_df.index, name="Band")]
+    return sums.groupby(keys).sum()[["n"] + SUM_COLUMNS]
+
+
+class AggregateTable:
+    """内存中的汇总表，支持增量累加"""
+
+    def __init__(self):
+        self.table = aggregate_frame(pd.DataFrame())
+        self.rows = 0
+
+    def rebuild(self, history_df):
+        self.table = aggregate_frame(history_df)
+        self.rows = len(history_df)
+
+    def add(self, history_df):
+        if history_df.empty:
+            return
+        self.table = self.table.add(aggregate_frame(history_df), fill_value=0)
+        self.rows += len(history_df)
+
+
+def _date_slice(agg, start=None, end=None):
+    days = agg.index.get_level_values("Day")
+    mask = np.ones(len(agg), dtype=bool)
+    if start:
+        mask &= days >= start
+    if end:
+        mask &= days < end
+    return agg[mask]
+
+
+def daily_band_counts(agg, start=None, end=None):
+    """每日各风险等级的记录数，行为日期，列为风险等级"""
+    agg = _date_slice(agg, start, end)
+    if agg.empty:
+        return pd.DataFrame(columns=RISK_BANDS)
+    counts = agg["n"].unstack("Band", fill_value=0).reindex(columns=RISK_BANDS, fill_value=0)
+    return counts.astype(int).sort_index()
+
+
+def band_feature_means(agg, start=None, end=None):
+    """各风险等级的记录数和特征均值"""
+    agg = _date_slice(agg, start, end)
+    if agg.empty:
+        return pd.DataFrame(columns=["n"] + SUM_COLUMNS)
+    totals = agg.groupby(level="Band").sum()
+    means = totals[SUM_COLUMNS].div(totals["n"], axis=0)
+    means.insert(0, "n", totals["n"].astype(int))
+    return means.reindex([band for band in RISK_BANDS if band in means.index])
+
+
+def _band_case(prefix):
+    low, high = RISK_THRESHOLDS
+    return (f"CASE WHEN {prefix}Risk_Probability < {low} THEN 'low_risk' "
+            f"WHEN {prefix}Risk_Probability < {high} THEN 'medium_risk' ELSE 'high_risk' END")
+
+
+def sqlite_schema():
+    """SQLite 汇总表、维护汇总表的触发器，以及由现有记录重建汇总表的语句"""
+    columns = ", ".join(f'"{col}"' for col in SUM_COLUMNS)
+    day = "substr({p}Timestamp, 1, 10)"
+    create_table = (f"CREATE TABLE IF NOT EXISTS {AGG_TABLE} (Day TEXT NOT NULL, Band TEXT NOT NULL, "
+                    f"n INTEGER NOT NULL, " + ", ".join(f'"{col}" REAL NOT NULL' for col in SUM_COLUMNS) +
+                    ", PRIMARY KEY (Day, Band))")
+    insert_trigger = (
+        f"CREATE TRIGGER IF NOT EXISTS {AGG_TABLE}_insert AFTER INSERT ON history BEGIN "
+        f"INSERT INTO {AGG_TABLE} (Day, Band, n, {columns}) VALUES ({day.format(p='NEW.')}, {_band_case('NEW.')}, 1, "
+        + ", ".join(f'COALESCE(NEW."{col}", 0)' for col in SUM_COLUMNS) +
+        ") ON CONFLICT (Day, Band) DO UPDATE SET n = n + 1, "
+        + ", ".join(f'"{col}" = "{col}" + excluded."{col}"' for col in SUM_COLUMNS) + "; END"
+    )
+    old_key = f"Day = {day.format(p='OLD.')} AND Band = {_band_case('OLD.')}"
+    delete_trigger = (
+        f"CREATE TRIGGER IF NOT EXISTS {AGG_TABLE}_delete AFTER DELETE ON history BEGIN "
+        f"UPDATE {AGG_TABLE} SET n = n - 1, "
+        + ", ".join(f'"{col}" = "{col}" - COALESCE(OLD."{col}", 0)' for col in SUM_COLUMNS) +
+        f" WHERE {old_key}; DELETE FROM {AGG_TABLE} WHERE {old_key} AND n <= 0; END"
+    )
+    rebuild = (
+        f"INSERT INTO {AGG_TABLE} (Day, Band, n, {columns}) "
+        f"SELECT {day.format(p='')}, {_band_case('')}, COUNT(*), "
+        + ", ".join(f'SUM(COALESCE("{col}", 0))' for col in SUM_COLUMNS) +
+        " FROM history GROUP BY 1, 2"
+    )
+    return create_table, insert_trigger, delete_trigger, rebuild
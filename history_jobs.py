@@ -0,0 +1,71 @@
+"""历史记录的后台任务（重新评估、群体 SHAP）共用的线程、取消、进度管理和检查点校验"""
+import threading
+
+
+def row_key(chunk):
+    """最后一行的时间和姓名，用于确认检查点处的记录没有变"""
+    row = chunk.iloc[-1]
+    return [str(row["Timestamp"]), str(row["Name"])]
+
+
+def history_changed(store, checkpoint):
+    """检查点之前的记录是否有删除或归档：编号不大于 last_id 的记录数与已处理数不一致，
+    或 last_id 处已不是原来的记录（CSV 的行号在删除后前移）"""
+    if checkpoint["last_id"] < 0:
+        return False
+    if store.count() - store.count_after(checkpoint["last_id"]) != checkpoint["done"]:
+        return True
+    row = store.feature_chunk(checkpoint["last_id"] - 1, 1)
+    return row.empty or int(row.index[0]) != checkpoint["last_id"] or row_key(row) != checkpoint.get("last_row")
+
+
+class HistoryJob:
+    """进程内的历史记录后台任务，同一时间只运行一个
+
+    run_fn(store, bundle, chunk_size, progress_callback, cancel_event) 返回最终进度，
+    例如 rescore.run_rescore 和 cohort_shap.run_cohort_shap；chunk_size 为默认的每批行数。
+    """
+
+    def __init__(self, run_fn, chunk_size):
+        self.run_fn = run_fn
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancel = threading.Event()
+        self._progress = {"status": "idle"}
+
+    def progress(self):
+        """status: idle / running / done / cancelled / failed，以及 done、total、rows_per_s 等"""
+        with self._lock:
+            return dict(self._progress)
+
+    @property
+    def running(self):
+        with self._lock:
+            return self._thread is not None and self._thread.is_alive()
+
+    def start(self, store, registry, chunk_size=None):
+        """启动后台任务；已在运行时返回 False"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            chunk_size = chunk_size or self.chunk_size
+            self._cancel.clear()
+            self._progress = {"status": "running", "done": 0, "total": None}
+            self._thread = threading.Thread(target=self._run, args=(store, registry, chunk_size),
+                                            name=f"history-{self.run_fn.__name__}", daemon=True)
+            self._thread.start()
+            return True
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _update(self, **progress):
+        with self._lock:
+            self._progress.update(progress)
+
+    def _run(self, store, registry, chunk_size):
+        try:
+            self._update(**self.run_fn(store, registry.get(), chunk_size, self._update, self._cancel))
+        except Exception as e:
+            self._update(status="failed", error=f"{type(e).__name__}: {e}")
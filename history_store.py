@@ -0,0 +1,1087 @@
+"""预测历史记录的读写，界面和 HTTP 服务共用
+
+提供两种存储后端，接口相同：
+- SqliteHistoryStore: SQLite（WAL 模式），Name 和 Timestamp 建有索引，
+  追加、删除和筛选查询只涉及相关的行（默认）
+- CsvHistoryStore: 原来的追加式 CSV 文件
+
+通过环境变量 DR_HISTORY_BACKEND=csv 可以切换回 CSV 后端。
+首次使用 SQLite 后端时会自动把已有的 CSV 历史迁移进数据库。
+
+界面通过 HistoryWriter 写入：记录放入队列后立即返回，由后台线程合并为一次提交。
+多个进程共用同一个历史记录目录时（DR_HISTORY_DIR），可以用 DR_HISTORY_FLUSH_MS
+让每个进程的写入线程先攒一段时间再提交，减少进程之间争用文件锁 / 数据库写锁。
+CSV 后端的写入持有文件锁（Unix 上为 fcntl.flock），整文件覆盖时先写临时文件再原子替换。
+
+趋势图读取的每日/风险等级汇总见 history_aggregates，随每次写入和删除增量更新。
+
+旧记录可以按月归档为 Parquet（archive_before），移出热数据；
+导出也可以选择保留数值类型的 Parquet 或 Arrow IPC（export_parquet / export_arrow）。
+"""
+import atexit
+import csv
+import io
+import os
+import platform
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+
+import history_aggregates
+from feature_schema import FEATURE_SCHEMA
+from features import FEATURES, HISTORY_COLUMNS, RESCORE_COLUMNS, risk_level_range
+from metrics import span
+
+try:
+    import fcntl
+except ImportError:  # Windows 上只在进程内加锁
+    fcntl = None
+
+is_windows = platform.system() == 'Windows'
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 根据操作系统选择不同的历史文件路径；DR_HISTORY_DIR 指定时使用该目录（例如多个进程共用的持久卷）
+if os.environ.get("DR_HISTORY_DIR"):
+    HISTORY_DIR = os.environ["DR_HISTORY_DIR"]
+elif is_windows:
+    HISTORY_DIR = os.path.join(base_dir, "history")
+else:
+    # 在Streamlit Cloud上使用/tmp目录确保有写入权限
+    HISTORY_DIR = "/tmp/history"
+HISTORY_PATH = os.path.join(HISTORY_DIR, "prediction_history.csv")
+HISTORY_DB_PATH = os.path.join(HISTORY_DIR, "prediction_history.db")
+# 按月分区的 Parquet 归档目录: archive/year=YYYY/month=MM/part-*.parquet
+ARCHIVE_DIR = os.path.join(HISTORY_DIR, "archive")
+
+HISTORY_BACKEND = os.environ.get("DR_HISTORY_BACKEND", "sqlite").lower()
+# 写入线程取到第一批记录后最多再等待的毫秒数，期间到达的记录合并为同一次提交
+HISTORY_FLUSH_MS = float(os.environ.get("DR_HISTORY_FLUSH_MS", 0))
+
+# 读取历史 CSV 时姓名按原样读为字符串：空白姓名读为空字符串，"NA"、"None" 等姓名不会被当作缺失值；
+# 其余文本列也按字符串读取，纯数字的姓名（"10086"）和模型版本哈希不会因逐块推断类型变成数字
+CSV_READ_OPTIONS = dict(converters={"Name": str},
+                        dtype=dict.fromkeys(["Gender", "Model_Version", "Rescore_Model_Version"], str))
+
+# 必须存在的列
+REQUIRED_COLUMNS = ["Timestamp", "Name", "Risk_Probability"]
+
+# 分页查询允许的排序列
+SORT_COLUMNS = ["Timestamp", "Name", "Risk_Probability"]
+
+
+def beijing_timestamp():
+    """返回当前北京时间字符串"""
+    beijing_tz = pytz.timezone('Asia/Shanghai')
+    return datetime.now(beijing_tz).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def make_record(name, gender, inputs, risk_probability, timestamp=None, model_version=None):
+    """按历史文件列顺序组装一行记录，重新评估的列留空"""
+    timestamp = timestamp or beijing_timestamp()
+    return [timestamp, name, gender] + [inputs[feat] for feat in FEATURES] + \
+        [risk_probability, model_version] + [None] * len(RESCORE_COLUMNS)
+
+
+def _frame_to_records(records_df, timestamp=None, model_version=None):
+    """DataFrame 转为记录列表，所有行使用同一时间戳，缺少的性别留空"""
+    records = records_df.reindex(columns=HISTORY_COLUMNS)
+    records["Timestamp"] = timestamp or beijing_timestamp()
+    records["Gender"] = records["Gender"].fillna("")
+    if model_version is not None:
+        records["Model_Version"] = model_version
+    return records
+
+
+def _to_rows(history_df):
+    """按列顺序转为行列表，缺失值转为 None 以便写入数据库"""
+    records = history_df.reindex(columns=HISTORY_COLUMNS)
+    return records.astype(object).where(records.notna(), None).values.tolist()
+
+
+def typed_history(history_df):
+    """转为列式存储使用的类型：时间戳为 datetime64，特征和概率为 float64"""
+    typed = history_df.reindex(columns=HISTORY_COLUMNS).reset_index(drop=True)
+    # 手工编辑过的 CSV 中可能混有只有日期等其他格式，逐个解析而不是按第一个值推断格式
+    typed["Timestamp"] = pd.to_datetime(typed["Timestamp"], errors="coerce", format="mixed")
+    for col in ["Name", "Gender", "Model_Version", "Rescore_Model_Version"]:
+        typed[col] = typed[col].astype("string")
+    typed[FEATURES] = FEATURE_SCHEMA.coerce_frame(typed)
+    for col in ["Risk_Probability", "Rescore_Probability"]:
+        typed[col] = pd.to_numeric(typed[col], errors="coerce").astype("float64")
+    return typed
+
+
+def to_parquet_bytes(history_df):
+    buf = io.BytesIO()
+    typed_history(history_df).to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+def to_arrow_bytes(history_df):
+    """未压缩的 Arrow IPC 文件，下游可以用 pyarrow.memory_map 直接映射读取"""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(typed_history(history_df), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def write_archive(history_df, archive_dir=ARCHIVE_DIR):
+    """按记录时间的年月分区写入 Parquet，返回写入的文件列表
+
+    每次归档在各分区下新增一个文件，先写临时文件再原子重命名。
+    有无法解析的时间戳时不写入任何文件并抛出 ValueError，调用方（move_where）不会删除记录。
+    """
+    typed = typed_history(history_df)
+    stamp = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    timestamps = typed["Timestamp"]
+    unparsed = int(timestamps.isna().sum())
+    if unparsed:
+        raise ValueError(f"{unparsed} 条记录的时间戳无法解析，未归档")
+    paths = []
+    n_written = 0
+    for (year, month), part in typed.groupby([timestamps.dt.year, timestamps.dt.month]):
+        part_dir = os.path.join(archive_dir, f"year={int(year)}", f"month={int(month):02d}")
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, f"part-{stamp}.parquet")
+        part.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+        n_written += len(part)
+    if n_written != len(typed):
+        raise ValueError(f"归档写入 {n_written} 条，应为 {len(typed)} 条")
+    return paths
+
+
+def load_archive(archive_dir=ARCHIVE_DIR, start=None, end=None):
+    """读取归档记录，start/end 为时间范围 [start, end)"""
+    if not os.path.isdir(archive_dir):
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    filters = []
+    if start:
+        filters.append(("Timestamp", ">=", pd.Timestamp(start)))
+    if end:
+        filters.append(("Timestamp", "<", pd.Timestamp(end)))
+    archive_df = pd.read_parquet(archive_dir, filters=filters or None)
+    return archive_df.reindex(columns=HISTORY_COLUMNS).sort_values("Timestamp", kind="stable", ignore_index=True)
+
+
+def archive_before(store, cutoff, archive_dir=ARCHIVE_DIR):
+    """把 cutoff（YYYY-MM-DD）之前的记录移到 Parquet 归档，返回归档的条数"""
+    return store.move_where(lambda records: write_archive(records, archive_dir), end=cutoff)
+
+
+def _prefix_upper_bound(prefix):
+    """前缀查询的上界：把最后一个字符加一，Name >= prefix AND Name < 上界 可以走索引"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _filter_mask(history_df, name=None, name_prefix=None, start=None, end=None, risk_level=None):
+    """筛选条件对应的布尔掩码，没有任何条件时返回 None"""
+    mask = None
+
+    def add(cond):
+        nonlocal mask
+        mask = cond if mask is None else mask & cond
+
+    if name is not None:
+        add(history_df["Name"] == name)
+    if name_prefix:
+        add(history_df["Name"].astype(str).str.startswith(name_prefix))
+    if start is not None:
+        add(history_df["Timestamp"] >= start)
+    if end is not None:
+        add(history_df["Timestamp"] < end)
+    if risk_level is not None:
+        low, high = risk_level_range(risk_level)
+        if low is not None:
+            add(history_df["Risk_Probability"] >= low)
+        if high is not None:
+            add(history_df["Risk_Probability"] < high)
+    return mask
+
+
+def _where_clause(name=None, name_prefix=None, start=None, end=None, risk_level=None):
+    """筛选条件对应的 SQL WHERE 子句和参数"""
+    clauses, params = [], []
+    if name is not None:
+        clauses.append("Name = ?")
+        params.append(name)
+    if name_prefix:
+        clauses.append("Name >= ? AND Name < ?")
+        params += [name_prefix, _prefix_upper_bound(name_prefix)]
+    if start is not None:
+        clauses.append("Timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("Timestamp < ?")
+        params.append(end)
+    if risk_level is not None:
+        low, high = risk_level_range(risk_level)
+        if low is not None:
+            clauses.append("Risk_Probability >= ?")
+            params.append(low)
+        if high is not None:
+            clauses.append("Risk_Probability < ?")
+            params.append(high)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def _check_sort(sort_by):
+    if sort_by not in SORT_COLUMNS:
+        raise ValueError(f"不支持的排序列: {sort_by}")
+
+
+def _check_columns(history_df):
+    # 检查必要的列是否存在
+    if not all(col in history_df.columns for col in REQUIRED_COLUMNS):
+        raise ValueError("历史文件格式不正确，缺少必要列")
+
+
+# 数值列：SQLite 中全为 NULL 的列读出来是 object（None），统一为 float64（NaN），与 CSV 后端一致
+NUMERIC_COLUMNS = FEATURES + ["Risk_Probability", "Rescore_Probability"]
+
+
+def _fix_numeric_dtypes(history_df):
+    """全为空值的 object 数值列转为 float64；含有无法解析的文本的列保持原样，由特征校验标出"""
+    for col in NUMERIC_COLUMNS:
+        if col in history_df.columns and history_df[col].dtype == object and history_df[col].isna().all():
+            history_df[col] = history_df[col].astype("float64")
+    return history_df
+
+
+def _append_rows(old_df, new_df):
+    """在缓存的记录后追加新记录
+
+    按列用 numpy 拼接：pd.concat 遇到开头全为空值的 object 列（例如旧记录没有模型版本）会逐个元素
+    检查是否全为空值，十万行时每次追加都要数百毫秒。
+    """
+    new_df = new_df.reindex(columns=old_df.columns)
+    columns = {}
+    for col in old_df.columns:
+        old_values, new_values = old_df[col].to_numpy(), new_df[col].to_numpy()
+        if old_values.dtype != new_values.dtype:
+            old_values, new_values = old_values.astype(object), new_values.astype(object)
+        columns[col] = np.concatenate([old_values, new_values])
+    # 拼接出的数组都是新的，不需要再复制合并成块
+    return pd.DataFrame(columns, index=old_df.index.append(new_df.index), copy=False)
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class _HistoryCache:
+    """进程内共享的历史记录缓存
+
+    以文件大小和 mtime 作为缓存键；文件只增长时由子类的 _refresh 增量读取新增部分，
+    否则重新全量读取。返回的 DataFrame 由所有会话共享，调用方不得原地修改。
+    """
+
+    def _init_cache(self):
+        self._cache_lock = threading.Lock()
+        self._cache = None
+        self._cache_version = 0
+        self._exports = {}
+
+    def _invalidate(self):
+        with self._cache_lock:
+            self._cache = None
+
+    def load_cached(self):
+        """返回最新的历史记录，文件未变化时不做任何读取"""
+        with self._cache_lock:
+            key = self._cache_key()
+            if self._cache is not None and self._cache[0] == key:
+                return self._cache[1]
+            history_df, cursor = self._refresh(self._cache)
+            self._on_refresh(history_df)
+            # 先取键再读取，读取期间发生的写入会在下次调用时增量读取
+            self._cache = (key, history_df, cursor)
+            self._cache_version += 1
+            return history_df
+
+    def _on_refresh(self, history_df):
+        """缓存更新后的钩子，在缓存锁内调用"""
+
+    @property
+    def cache_version(self):
+        return self._cache_version
+
+    def _export(self, fmt, build):
+        """同一缓存版本、同一格式只生成一次导出"""
+        history_df = self.load_cached()
+        with self._cache_lock:
+            cached = self._exports.get(fmt)
+            if cached is not None and cached[0] == self._cache_version:
+                return cached[1]
+            data = build(history_df)
+            self._exports[fmt] = (self._cache_version, data)
+            return data
+
+    def export_csv(self):
+        """导出全部历史为 CSV 字节串"""
+        return self._export("csv", lambda history_df: history_df.to_csv(index=False).encode('utf-8'))
+
+    def export_parquet(self):
+        """导出全部历史为 Parquet 字节串，数值列保持 float64"""
+        return self._export("parquet", to_parquet_bytes)
+
+    def export_arrow(self):
+        """导出全部历史为 Arrow IPC 文件字节串"""
+        return self._export("arrow", to_arrow_bytes)
+
+
+class CsvHistoryStore(_HistoryCache):
+    """追加式 CSV 历史记录，行号即记录编号"""
+
+    backend = "csv"
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._aggregates = history_aggregates.AggregateTable()
+        self._appended_from = None
+        self._init_cache()
+
+    @contextmanager
+    def _locked(self):
+        """写入锁：进程内用线程锁，进程间用 .lock 文件上的 flock"""
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_header(self):
+        """文件不存在时写入表头；旧版本的文件缺少新增的列时补齐后重写"""
+        if os.path.exists(self.path):
+            with open(self.path, newline='', encoding='utf-8', errors='replace') as f:
+                header = next(csv.reader(f), None)
+            if header and header != HISTORY_COLUMNS:
+                self._replace(pd.read_csv(self.path, **CSV_READ_OPTIONS).reindex(columns=HISTORY_COLUMNS))
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(HISTORY_COLUMNS)
+        # 设置文件权限 (Unix系统)
+        if not is_windows:
+            os.chmod(self.path, 0o644)
+
+    def _replace(self, history_df):
+        """先写临时文件再原子替换，读取方只会看到完整的旧文件或新文件"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        history_df.to_csv(tmp_path, index=False)
+        if not is_windows:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.path)
+        self._invalidate()
+
+    def init(self):
+        """历史文件不存在时写入表头"""
+        if os.path.exists(self.path):
+            return
+        with self._locked():
+            self._write_header()
+
+    def append_records(self, records):
+        """一次打开文件追加多行记录"""
+        with self._locked():
+            self._write_header()
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerows(records)
+
+    def append_frame(self, records_df, timestamp=None, model_version=None):
+        records = _frame_to_records(records_df, timestamp, model_version)
+        with self._locked():
+            self._write_header()
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                records.to_csv(f, header=False, index=False)
+
+    def load(self):
+        """读取全部历史记录，文件格式不正确时抛出 ValueError"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return pd.DataFrame()
+        # 尝试不同编码
+        try:
+            history_df = pd.read_csv(self.path, **CSV_READ_OPTIONS)
+        except UnicodeDecodeError:
+            history_df = pd.read_csv(self.path, encoding='latin-1', **CSV_READ_OPTIONS)
+        _check_columns(history_df)
+        return history_df
+
+    def _cache_key(self):
+        return _stat_key(self.path)
+
+    def _read_bytes(self, data, names=None):
+        # 尝试不同编码
+        header = None if names is not None else 'infer'
+        try:
+            return pd.read_csv(io.BytesIO(data), header=header, names=names, **CSV_READ_OPTIONS)
+        except UnicodeDecodeError:
+            return pd.read_csv(io.BytesIO(data), header=header, names=names, encoding='latin-1', **CSV_READ_OPTIONS)
+
+    def _refresh(self, cached):
+        """cursor 为已解析到的字节偏移，只解析完整的行"""
+        key = self._cache_key()
+        if key is None or key[1] == 0:
+            return pd.DataFrame(), 0
+        self._appended_from = None
+        with open(self.path, 'rb') as f:
+            if cached is not None and cached[0] is not None and not cached[1].empty \
+                    and cached[0][0] == key[0] and key[1] >= cached[2]:
+                old_df, offset = cached[1], cached[2]
+                self._appended_from = len(old_df)
+                f.seek(offset)
+                data = f.read()
+                consumed = data.rfind(b'\n') + 1
+                if consumed == 0:
+                    return old_df, offset
+                new_df = self._read_bytes(data[:consumed], names=list(old_df.columns))
+                new_df.index = pd.RangeIndex(len(old_df), len(old_df) + len(new_df))
+                return _append_rows(old_df, new_df), offset + consumed
+
+            data = f.read()
+        consumed = data.rfind(b'\n') + 1
+        history_df = self._read_bytes(data[:consumed] if consumed else data)
+        _check_columns(history_df)
+        return history_df, consumed or len(data)
+
+    def _on_refresh(self, history_df):
+        # 只追加了新行时累加新行，否则（文件被重写）重新汇总
+        if self._appended_from is not None and self._appended_from == self._aggregates.rows:
+            self._aggregates.add(history_df.iloc[self._appended_from:])
+        else:
+            self._aggregates.rebuild(history_df)
+
+    def _aggregate_table(self):
+        self.load_cached()
+        with self._cache_lock:
+            return self._aggregates.table
+
+    def daily_band_counts(self, start=None, end=None):
+        """每日各风险等级的记录数，start/end 为日期范围 [start, end)"""
+        return history_aggregates.daily_band_counts(self._aggregate_table(), start, end)
+
+    def band_feature_means(self, start=None, end=None):
+        """各风险等级的记录数和特征均值"""
+        return history_aggregates.band_feature_means(self._aggregate_table(), start, end)
+
+    def patient_trajectory(self, name):
+        """某位患者按时间排序的风险概率"""
+        history_df = self.load_cached()
+        if history_df.empty:
+            return pd.DataFrame(columns=["Timestamp", "Risk_Probability"])
+        matched = history_df.loc[history_df["Name"].astype(str) == name, ["Timestamp", "Risk_Probability"]]
+        return matched.sort_values("Timestamp", kind="stable")
+
+    def feature_chunk(self, after_id=-1, chunk_size=50000):
+        """编号大于 after_id 的下一批记录（时间、姓名和特征），用于重新评估"""
+        history_df = self.load_cached()
+        if history_df.empty:
+            return pd.DataFrame(columns=["Timestamp", "Name"] + FEATURES)
+        return history_df.loc[history_df.index > after_id, ["Timestamp", "Name"] + FEATURES].iloc[:chunk_size]
+
+    def count_after(self, after_id=-1):
+        history_df = self.load_cached()
+        return int((history_df.index > after_id).sum()) if not history_df.empty else 0
+
+    def write_rescores(self, chunk, probs, model_version):
+        """把重新评估的概率写在原评分旁边，返回更新的条数
+
+        CSV 以行号为编号，写入前核对时间和姓名，期间被删除或移动的行跳过。
+        """
+        with self._locked():
+            history_df = self.load_cached().reindex(columns=HISTORY_COLUMNS)
+            # 旧文件中版本列全为空时会被读成浮点列
+            history_df["Rescore_Model_Version"] = history_df["Rescore_Model_Version"].astype(object)
+            ids = chunk.index[chunk.index.isin(history_df.index)]
+            current = history_df.loc[ids]
+            unchanged = (current["Timestamp"].astype(str).values == chunk.loc[ids, "Timestamp"].astype(str).values) & \
+                        (current["Name"].astype(str).values == chunk.loc[ids, "Name"].astype(str).values)
+            ids = ids[unchanged]
+            history_df.loc[ids, "Rescore_Probability"] = pd.Series(probs, index=chunk.index).loc[ids].values
+            history_df.loc[ids, "Rescore_Model_Version"] = model_version
+            self._replace(history_df)
+        return len(ids)
+
+    def query(self, **filters):
+        """按条件筛选（CSV 只能在缓存的全量记录上过滤）
+
+        支持的条件: name, name_prefix, start, end, risk_level
+        """
+        history_df = self.load_cached()
+        if history_df.empty:
+            return history_df
+        mask = _filter_mask(history_df, **filters)
+        return history_df if mask is None else history_df[mask]
+
+    def query_page(self, page=0, page_size=50, sort_by="Timestamp", descending=True, **filters):
+        """返回 (当前页记录, 符合条件的总数)"""
+        _check_sort(sort_by)
+        matched = self.query(**filters)
+        if matched.empty:
+            return matched, 0
+        order = matched[sort_by].sort_values(ascending=not descending, kind="stable").index
+        start = page * page_size
+        return matched.loc[order[start:start + page_size]], len(matched)
+
+    def search_names(self, prefix="", limit=20):
+        """按前缀返回去重后的患者姓名，用于姓名联想"""
+        history_df = self.load_cached()
+        if history_df.empty:
+            return []
+        names = history_df["Name"].astype(str)
+        if prefix:
+            names = names[names.str.startswith(prefix)]
+        return sorted(names.unique())[:limit]
+
+    def tail(self, n=200):
+        return self.load_cached().tail(n)
+
+    def count(self):
+        return len(self.load_cached())
+
+    def delete(self, record_ids):
+        """按行号删除记录，文件不存在时返回 False"""
+        with self._locked():
+            if not os.path.exists(self.path):
+                return False
+            history_df = pd.read_csv(self.path, **CSV_READ_OPTIONS)
+            # 保留不在删除列表中的记录
+            updated_history = history_df[~history_df.index.isin(record_ids)]
+            # 保存更新后的记录
+            self._replace(updated_history)
+        return True
+
+    def delete_where(self, **filters):
+        """删除符合筛选条件的全部记录，返回删除的条数"""
+        with self._locked():
+            # 持有写入锁后再读取，期间其他写入方追加的记录不会被覆盖掉
+            history_df = self.load_cached()
+            if history_df.empty:
+                return 0
+            mask = _filter_mask(history_df, **filters)
+            if mask is None:
+                raise ValueError("批量删除至少需要一个筛选条件")
+            n_deleted = int(mask.sum())
+            if n_deleted:
+                self._replace(history_df[~mask])
+        return n_deleted
+
+    def move_where(self, sink, **filters):
+        """把符合条件的记录交给 sink 保存后再从历史文件中删除，返回移动的条数
+
+        整个过程持有写入锁；sink 抛出异常时历史文件保持不变（write_archive 写入的行数
+        与符合条件的行数不一致时会抛出异常）。
+        """
+        with self._locked():
+            history_df = self.load_cached()
+            if history_df.empty:
+                return 0
+            mask = _filter_mask(history_df, **filters)
+            if mask is None:
+                raise ValueError("移动记录至少需要一个筛选条件")
+            n_moved = int(mask.sum())
+            if n_moved:
+                sink(history_df[mask])
+                self._replace(history_df[~mask])
+        return n_moved
+
+    def write(self, history_df):
+        """用给定的记录覆盖历史文件"""
+        with self._locked():
+            self._replace(history_df)
+
+
+class SqliteHistoryStore(_HistoryCache):
+    """SQLite 历史记录，自增 id 即记录编号"""
+
+    backend = "sqlite"
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._columns_sql = ", ".join(f'"{col}"' for col in HISTORY_COLUMNS)
+        self._placeholders = ", ".join("?" for _ in HISTORY_COLUMNS)
+        self._initialized = False
+        self._init_cache()
+
+    def _connect(self):
+        # sqlite3 连接不能跨线程使用，Streamlit 的每个会话线程各持有一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            self._create_schema(conn)
+        return conn
+
+    def _create_schema(self, conn):
+        feature_columns = ", ".join(f'"{feat}" REAL' for feat in FEATURES)
+        with conn:
+            # 建表、迁移和重建汇总放在同一个写事务中，多个进程同时启动时依次执行
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "Timestamp TEXT NOT NULL, Name TEXT NOT NULL, Gender TEXT, "
+                f"{feature_columns}, Risk_Probability REAL, Model_Version TEXT, "
+                "Rescore_Probability REAL, Rescore_Model_Version TEXT)"
+            )
+            # 旧版本建的表缺少模型版本和重新评估的列
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+            for col, col_type in [("Model_Version", "TEXT"), ("Rescore_Probability", "REAL"),
+                                  ("Rescore_Model_Version", "TEXT")]:
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE history ADD COLUMN {col} {col_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_name ON history(Name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(Timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_risk ON history(Risk_Probability)")
+            # 覆盖索引：患者趋势只读索引，不回表
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_name_time "
+                         "ON history(Name, Timestamp, Risk_Probability)")
+            # 由触发器维护的每日/风险等级汇总表，首次创建时由已有记录重建
+            create_table, insert_trigger, delete_trigger, rebuild = history_aggregates.sqlite_schema()
+            has_aggregates = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                          (history_aggregates.AGG_TABLE,)).fetchone()
+            conn.execute(create_table)
+            conn.execute(insert_trigger)
+            conn.execute(delete_trigger)
+            if not has_aggregates:
+                conn.execute(rebuild)
+            # 修改计数：UPDATE / DELETE 时加一（包括其他进程），进程内缓存据此判断能否只增量读取新增的记录
+            conn.execute("CREATE TABLE IF NOT EXISTS history_changes ("
+                         "id INTEGER PRIMARY KEY CHECK (id = 0), n INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO history_changes (id, n) VALUES (0, 0)")
+            for event in ("UPDATE", "DELETE"):
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS history_changes_{event.lower()} AFTER {event} ON history "
+                             "BEGIN UPDATE history_changes SET n = n + 1 WHERE id = 0; END")
+        self._initialized = True
+
+    def init(self):
+        self._connect()
+
+    def append_records(self, records):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO history ({self._columns_sql}) VALUES ({self._placeholders})",
+                records
+            )
+
+    def append_frame(self, records_df, timestamp=None, model_version=None):
+        self.append_records(_to_rows(_frame_to_records(records_df, timestamp, model_version)))
+
+    def _read(self, sql, params=()):
+        return pd.read_sql_query(sql, self._connect(), params=params, index_col="id")
+
+    def load(self):
+        history_df = self._read(f"SELECT id, {self._columns_sql} FROM history ORDER BY id")
+        if history_df.empty:
+            return pd.DataFrame()
+        return _fix_numeric_dtypes(history_df)
+
+    def _cache_key(self):
+        # WAL 模式下新提交的数据先写入 -wal 文件
+        return _stat_key(self.path), _stat_key(self.path + "-wal")
+
+    def _refresh(self, cached):
+        """cursor 为 (已缓存的最大 id, 修改计数)
+
+        修改计数未变（只新增了记录）时增量读取；任何连接（包括其他进程）修改或删除过记录时重新全量读取。
+        先读修改计数再读记录，读取期间发生的修改会在下次刷新时发现。
+        """
+        changes = self._connect().execute("SELECT n FROM history_changes WHERE id = 0").fetchone()[0]
+        if cached is not None and not cached[1].empty and cached[2][1] == changes:
+            old_df, (last_id, _) = cached[1], cached[2]
+            new_df = self._read(
+                f"SELECT id, {self._columns_sql} FROM history WHERE id > ? ORDER BY id", (last_id,)
+            )
+            if new_df.empty:
+                return old_df, cached[2]
+            history_df = _append_rows(old_df, _fix_numeric_dtypes(new_df))
+            return history_df, (int(history_df.index[-1]), changes)
+        history_df = self.load()
+        if history_df.empty:
+            return history_df, (0, changes)
+        return history_df, (int(history_df.index[-1]), changes)
+
+    def _aggregate_table(self, start=None, end=None):
+        clauses, params = [], []
+        if start:
+            clauses.append("Day >= ?")
+            params.append(start)
+        if end:
+            clauses.append("Day < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        agg = pd.read_sql_query(f"SELECT * FROM {history_aggregates.AGG_TABLE} {where}", self._connect(),
+                                params=params)
+        return agg.set_index(["Day", "Band"])
+
+    def daily_band_counts(self, start=None, end=None):
+        """每日各风险等级的记录数，只读取汇总表"""
+        return history_aggregates.daily_band_counts(self._aggregate_table(start, end))
+
+    def band_feature_means(self, start=None, end=None):
+        """各风险等级的记录数和特征均值，只读取汇总表"""
+        return history_aggregates.band_feature_means(self._aggregate_table(start, end))
+
+    def patient_trajectory(self, name):
+        """某位患者按时间排序的风险概率，只读取 (Name, Timestamp, Risk_Probability) 覆盖索引"""
+        return pd.read_sql_query(
+            "SELECT Timestamp, Risk_Probability FROM history WHERE Name = ? ORDER BY Timestamp",
+            self._connect(), params=(name,)
+        )
+
+    def feature_chunk(self, after_id=-1, chunk_size=50000):
+        """编号大于 after_id 的下一批记录（时间、姓名和特征），按主键顺序分批读取，用于重新评估"""
+        feature_columns = ", ".join(f'"{feat}"' for feat in FEATURES)
+        return self._read(f"SELECT id, Timestamp, Name, {feature_columns} FROM history "
+                          f"WHERE id > ? ORDER BY id LIMIT ?", (after_id, chunk_size))
+
+    def count_after(self, after_id=-1):
+        return self._connect().execute("SELECT COUNT(*) FROM history WHERE id > ?", (after_id,)).fetchone()[0]
+
+    def write_rescores(self, chunk, probs, model_version):
+        """把重新评估的概率写在原评分旁边，返回更新的条数"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.executemany(
+                "UPDATE history SET Rescore_Probability = ?, Rescore_Model_Version = ? WHERE id = ?",
+                [(float(prob), model_version, int(record_id)) for record_id, prob in zip(chunk.index, probs)]
+            )
+        # 本进程立即失效；其他进程的缓存由修改计数发现
+        self._invalidate()
+        return cursor.rowcount
+
+    def query(self, **filters):
+        """按条件筛选，只读取命中索引的行
+
+        支持的条件: name, name_prefix, start, end, risk_level
+        """
+        where, params = _where_clause(**filters)
+        return self._read(f"SELECT id, {self._columns_sql} FROM history {where} ORDER BY id", params)
+
+    def query_page(self, page=0, page_size=50, sort_by="Timestamp", descending=True, **filters):
+        """返回 (当前页记录, 符合条件的总数)，只读取当前页的行"""
+        _check_sort(sort_by)
+        where, params = _where_clause(**filters)
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM history {where}", params).fetchone()[0]
+        direction = "DESC" if descending else "ASC"
+        page_df = self._read(
+            f"SELECT id, {self._columns_sql} FROM history {where} "
+            f"ORDER BY \"{sort_by}\" {direction}, id {direction} LIMIT ? OFFSET ?",
+            params + [page_size, page * page_size]
+        )
+        return page_df, total
+
+    def search_names(self, prefix="", limit=20):
+        """按前缀返回去重后的患者姓名，用于姓名联想"""
+        where, params = _where_clause(name_prefix=prefix)
+        rows = self._connect().execute(
+            f"SELECT DISTINCT Name FROM history {where} ORDER BY Name LIMIT ?", params + [limit]
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def tail(self, n=200):
+        history_df = self._read(f"SELECT id, {self._columns_sql} FROM history ORDER BY id DESC LIMIT ?", (n,))
+        return history_df.iloc[::-1]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def delete(self, record_ids):
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM history WHERE id = ?", [(int(i),) for i in record_ids])
+        self._invalidate()
+        return True
+
+    def delete_where(self, **filters):
+        """用一条 DELETE 语句删除符合筛选条件的全部记录，返回删除的条数"""
+        where, params = _where_clause(**filters)
+        if not where:
+            raise ValueError("批量删除至少需要一个筛选条件")
+        conn = self._connect()
+        with conn:
+            n_deleted = conn.execute(f"DELETE FROM history {where}", params).rowcount
+        self._invalidate()
+        return n_deleted
+
+    def move_where(self, sink, **filters):
+        """把符合条件的记录交给 sink 保存后再删除，返回移动的条数
+
+        在同一个写事务（BEGIN IMMEDIATE）中完成，sink 抛出异常时回滚。
+        """
+        where, params = _where_clause(**filters)
+        if not where:
+            raise ValueError("移动记录至少需要一个筛选条件")
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            moved = self._read(f"SELECT id, {self._columns_sql} FROM history {where} ORDER BY id", params)
+            if not moved.empty:
+                sink(moved)
+                conn.execute(f"DELETE FROM history {where}", params)
+        self._invalidate()
+        return len(moved)
+
+    def write(self, history_df):
+        """清空后写入给定的记录"""
+        records = _to_rows(history_df)
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM history")
+            conn.executemany(
+                f"INSERT INTO history ({self._columns_sql}) VALUES ({self._placeholders})",
+                records
+            )
+        self._invalidate()
+
+
+def is_transient_write_error(error):
+    """数据库被其他连接锁住时稍后重试即可；其余错误（缺少列、只读、磁盘已满、违反约束）重试也不会成功"""
+    return isinstance(error, sqlite3.OperationalError) and any(
+        word in str(error) for word in ("database is locked", "database table is locked", "busy"))
+
+
+def quarantine_records(path, records, error):
+    """把无法写入的记录追加到隔离文件，保留原始值和错误信息"""
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(HISTORY_COLUMNS + ["Error"])
+        writer.writerows(list(record) + [error] for record in records)
+
+
+def migrate_csv_to_sqlite(csv_path=HISTORY_PATH, db_path=HISTORY_DB_PATH):
+    """把 CSV 历史一次性导入 SQLite，导入后将 CSV 重命名为 .migrated
+
+    数据库中已有记录时不做任何操作，返回导入的行数。多个进程同时启动时（deploy.py），
+    检查和导入在同一个写事务（BEGIN IMMEDIATE）中进行，只有一个进程导入；
+    CSV 已被其他进程重命名时视为已完成。缺少时间戳的行无法写入（NOT NULL），
+    移到隔离文件（<CSV>.rejected.csv），不计入导入的行数。
+    """
+    if not os.path.exists(csv_path):
+        return 0
+    store = SqliteHistoryStore(db_path)
+    conn = store._connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not os.path.exists(csv_path) or conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] > 0:
+            return 0
+        history_df = CsvHistoryStore(csv_path).load()
+        if not history_df.empty:
+            missing_timestamp = history_df["Timestamp"].isna()
+            if missing_timestamp.any():
+                quarantine_records(csv_path + ".rejected.csv", _to_rows(history_df[missing_timestamp]),
+                                   "missing Timestamp")
+                history_df = history_df[~missing_timestamp]
+            conn.executemany(f"INSERT INTO history ({store._columns_sql}) VALUES ({store._placeholders})",
+                             _to_rows(history_df))
+    # 提交之后再重命名：等待写锁的进程进入事务时已能看到导入的记录
+    try:
+        os.replace(csv_path, csv_path + ".migrated")
+    except FileNotFoundError:
+        pass
+    return len(history_df)
+
+
+class HistoryWriter:
+    """后台写入线程
+
+    submit() 只把记录放入队列，不访问磁盘；写入线程取出队列中积压的全部记录，
+    合并为一次 append_records 提交。max_delay（秒）大于 0 时，取到第一批记录后
+    再等待至多 max_delay 收集后续记录。
+
+    数据库被锁时保留这批记录，每隔 retry_delay 秒重试，最多 max_retries 次；其余失败（例如违反
+    NOT NULL 约束）逐行重新提交。仍然失败的行写入隔离文件（<历史文件>.rejected.csv）并计入
+    dropped_records，不再阻塞后续记录。
+    """
+
+    def __init__(self, store, max_batch_size=5000, retry_delay=1.0, max_delay=0.0, max_retries=10):
+        self.store = store
+        self.max_batch_size = max_batch_size
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.last_error = None
+        self.commits = 0
+        self.committed_records = 0
+        self.dropped_records = 0
+        self.last_dropped_error = None
+        self.quarantine_path = store.path + ".rejected.csv"
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, records):
+        """放入待写入的记录（make_record 生成的行），立即返回"""
+        records = list(records)
+        if not records:
+            return
+        self._ensure_thread()
+        with self._cond:
+            self._pending += len(records)
+        self._queue.put(records)
+
+    def submit_frame(self, records_df, timestamp=None, model_version=None):
+        self.submit(_to_rows(_frame_to_records(records_df, timestamp, model_version)))
+
+    @property
+    def pending(self):
+        with self._cond:
+            return self._pending
+
+    def flush(self, timeout=None):
+        """等待队列中的记录全部提交，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def _quarantine(self, records, error):
+        try:
+            quarantine_records(self.quarantine_path, records, error)
+        except OSError:
+            pass
+        self.last_dropped_error = error
+        self.last_error = None
+        return len(records)
+
+    def _commit(self, batch):
+        """提交一批记录，返回无法写入而移到隔离文件的行数"""
+        attempts = 0
+        while True:
+            try:
+                with span("history_group_commit"):
+                    self.store.append_records(batch)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if is_transient_write_error(e):
+                    attempts += 1
+                    if attempts > self.max_retries:
+                        return self._quarantine(batch, self.last_error)
+                    time.sleep(self.retry_delay)
+                    continue
+                if len(batch) > 1:
+                    # 找出有问题的行，其余行照常提交
+                    return sum(self._commit([record]) for record in batch)
+                return self._quarantine(batch, self.last_error)
+            self.last_error = None
+            return 0
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                try:
+                    timeout = deadline - time.monotonic()
+                    batch += self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            dropped = self._commit(batch)
+            with self._cond:
+                self.commits += 1
+                self.committed_records += len(batch) - dropped
+                self.dropped_records += dropped
+                self._pending -= len(batch)
+                self._cond.notify_all()
+
+
+_stores = {}
+_writers = {}
+_stores_lock = threading.Lock()
+# CSV 迁移到 SQLite 失败时的错误信息；此时 get_store 继续使用 CSV 历史，由界面显示错误
+migration_error = None
+
+
+def get_store(backend=HISTORY_BACKEND):
+    """返回进程内共享的历史记录存储"""
+    global migration_error
+    with _stores_lock:
+        store = _stores.get(backend)
+        if store is None:
+            if backend == "csv":
+                store = CsvHistoryStore(HISTORY_PATH)
+            elif backend == "sqlite":
+                try:
+                    migrate_csv_to_sqlite(HISTORY_PATH, HISTORY_DB_PATH)
+                    store = SqliteHistoryStore(HISTORY_DB_PATH)
+                except (sqlite3.Error, ValueError, OSError) as e:
+                    # 迁移在事务中回滚，CSV 保持原样，下次启动时重新迁移
+                    migration_error = f"{type(e).__name__}: {e}"
+                    store = CsvHistoryStore(HISTORY_PATH)
+            else:
+                raise ValueError(f"未知的历史记录后端: {backend}")
+            _stores[backend] = store
+        return store
+
+
+def get_writer(backend=HISTORY_BACKEND):
+    """返回进程内共享的后台写入线程"""
+    store = get_store(backend)
+    with _stores_lock:
+        writer = _writers.get(backend)
+        if writer is None:
+            writer = _writers[backend] = HistoryWriter(store, max_delay=HISTORY_FLUSH_MS / 1000)
+        return writer
+
+
+@atexit.register
+def _flush_writers():
+    # 写入线程是守护线程，进程退出前把队列中的记录写完
+    for writer in list(_writers.values()):
+        writer.flush(timeout=10)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把 CSV 历史记录迁移到 SQLite，或把旧记录归档为 Parquet")
+    parser.add_argument("--csv", default=HISTORY_PATH)
+    parser.add_argument("--db", default=HISTORY_DB_PATH)
+    parser.add_argument("--archive-before", help="归档该日期（YYYY-MM-DD）之前的记录")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+    if args.archive_before:
+        n_archived = archive_before(get_store(), args.archive_before, args.archive_dir)
+        print(f"archived {n_archived} records -> {args.archive_dir}")
+    else:
+        print(f"migrated {migrate_csv_to_sqlite(args.csv, args.db)} records -> {args.db}")
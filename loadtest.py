@@ -0,0 +1,300 @@
+"""端到端负载测试：用 Streamlit AppTest 模拟多个并发会话
+
+每个会话独立执行 app3.py（与真实部署相同，同一进程内的会话共享模型、缓存和历史记录存储）:
+- guest: 以访客登录 → 填写姓名和 10 项指标 → 开始评估，重复 --assessments 次
+- investigator: 以调查人员登录 → 评估 → 翻阅历史记录的前 --pages 页
+
+输出会话吞吐量、各类操作的重跑延迟分位数、每个会话的内存增长（RSS），
+以及进程内残留的 matplotlib 图像数和线程数，用于估算服务器规格和发现泄漏。
+AppTest 测得的重跑延迟包含脚本执行和元素树构建，不含浏览器渲染和网络。
+AppTest 不支持同一进程内的重跑并行执行，同一进程内的重跑依次进行（等待时间单独统计为
+rerun_queue_wait），用 --processes 模拟 deploy.py 的多个工作进程。
+
+默认使用临时的历史记录目录（预先写入 --history-rows 条记录），不影响正式数据。
+
+用法: python loadtest.py --guests 20 --investigators 5 --concurrency 8 --processes 2 --output loadtest.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app3.py")
+START_LABELS = ("Start Assessment", "开始评估")
+INVESTIGATOR = ("DR", "000000")
+
+# share_script_cache 验证过的 streamlit 版本范围（主版本, 次版本）
+TESTED_STREAMLIT = ((1, 52), (1, 65))
+
+# AppTest 每次重跑都会替换全局的 Runtime 实例和配置，同一进程内的重跑只能依次执行；
+# 会话本身（session_state、元素树）同时存在，多个进程（--processes）才真正并行
+_run_lock = threading.Lock()
+
+
+def open_figures():
+    """残留的 matplotlib 图像数；未导入 matplotlib 时为 0"""
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    return len(pyplot.get_fignums()) if pyplot is not None else 0
+
+
+def random_inputs(n, seed):
+    """n 组随机输入：在模型各特征的分裂边界范围内采样（explain.sample_inputs），
+    再限制在特征的合理范围内，使评估结果和缓存命中情况接近真实"""
+    from explain import sample_inputs
+    from feature_schema import FEATURE_SCHEMA
+    from model_registry import get_registry
+
+    samples = sample_inputs(get_registry().get().model, n, seed)[FEATURE_SCHEMA.features]
+    lows = [FEATURE_SCHEMA.ranges[feat][0] for feat in FEATURE_SCHEMA.features]
+    highs = [FEATURE_SCHEMA.ranges[feat][1] for feat in FEATURE_SCHEMA.features]
+    return samples.clip(lower=lows, upper=highs, axis=1).round(2).to_dict(orient="records")
+
+
+class Session:
+    """一个模拟会话，记录每次重跑的 (操作, 秒)"""
+
+    def __init__(self, kind, index, seed, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.kind = kind
+        self.name = f"load-{kind}-{index}"
+        self.seed = seed
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.timings = []
+        self.waits = []
+        self.errors = []
+
+    def _run(self, action, element=None):
+        queued = time.perf_counter()
+        with _run_lock:
+            start = time.perf_counter()
+            (element if element is not None else self.at).run()
+            self.timings.append((action, time.perf_counter() - start))
+        self.waits.append(start - queued)
+        if self.at.exception:
+            self.errors.append(f"{action}: {self.at.exception[0].message}")
+            return False
+        return True
+
+    def login(self):
+        if not self._run("open"):
+            return False
+        if self.kind == "investigator":
+            self.at.text_input(key="username").input(INVESTIGATOR[0])
+            self.at.text_input(key="password").input(INVESTIGATOR[1])
+            return self._run("login", self.at.button(key="investigator_btn").click())
+        return self._run("login", self.at.button(key="guest_btn").click())
+
+    def assess(self, inputs):
+        self.at.sidebar.text_input[0].input(self.name)
+        for feat, value in inputs.items():
+            self.at.text_input(key=f"input_{feat}").input(str(value))
+        if not self._run("fill_inputs"):
+            return False
+        buttons = [button for button in self.at.button if button.label in START_LABELS]
+        if not buttons:
+            self.errors.append("assess: start button not found")
+            return False
+        return self._run("assess", buttons[0].click())
+
+    def page_history(self, pages):
+        for page in range(2, pages + 1):
+            page_inputs = [element for element in self.at.number_input if element.key == "history_page"]
+            if not page_inputs or (page_inputs[0].max is not None and page > page_inputs[0].max):
+                break
+            if not self._run("history_page", page_inputs[0].set_value(page)):
+                return False
+        return True
+
+    def play(self, assessments, pages):
+        if not self.login():
+            return
+        for inputs in random_inputs(assessments, self.seed):
+            if not self.assess(inputs):
+                return
+        if self.kind == "investigator":
+            self.page_history(pages)
+
+
+def share_script_cache():
+    """让所有 AppTest 会话共用一个已编译的脚本缓存
+
+    AppTest 每次重跑都新建 ScriptCache 并重新编译 app3.py，而真实服务器进程内只编译一次；
+    多个线程同时编译在 Python 3.11 上还会触发 "AST constructor recursion depth mismatch"。
+    这里替换的是 AppTest 的内部实现，实现改变时直接报错，而不是悄悄失效。
+    """
+    import inspect
+
+    import streamlit
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    version = tuple(int(part) for part in streamlit.__version__.split(".")[:2])
+    if not TESTED_STREAMLIT[0] <= version <= TESTED_STREAMLIT[1]:
+        print(f"warning: share_script_cache is untested on streamlit {streamlit.__version__}", file=sys.stderr)
+    if (getattr(local_script_runner, "ScriptCache", None) is not ScriptCache
+            or "ScriptCache()" not in inspect.getsource(local_script_runner.LocalScriptRunner)):
+        raise RuntimeError(f"streamlit {streamlit.__version__} 的 AppTest 不再在 LocalScriptRunner 中创建 "
+                           "ScriptCache()，无法共用脚本缓存；请安装已验证的版本或更新 loadtest.share_script_cache")
+
+    shared = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared
+
+
+def seed_history(n_rows):
+    import history_store
+    from bench import synthetic_history
+
+    store = history_store.get_store()
+    store.init()
+    if n_rows:
+        store.append_frame(synthetic_history(n_rows))
+
+
+def percentiles(samples):
+    from bench import percentiles_ms
+
+    return dict(count=len(samples), **percentiles_ms(samples, (50, 90, 99)), max_ms=float(np.max(samples) * 1000))
+
+
+def run_sessions(kinds, first_index, concurrency, assessments, pages, timeout, seed):
+    """在当前进程中运行一组会话（先预热一个不计入结果的会话），返回原始测量结果"""
+    from bench import current_rss_mb
+
+    share_script_cache()
+    Session("guest", -1 - first_index, seed, timeout).play(1, 0)
+
+    rss_before = current_rss_mb()
+    figures_before = open_figures()
+    threads_before = threading.active_count()
+
+    def play(args):
+        index, kind = args
+        session = Session(kind, index, seed + index + 1, timeout)
+        session.play(assessments, pages)
+        # 会话结束后释放 AppTest（元素树和 session_state），剩下的内存增长才是进程内的残留
+        session.at = None
+        return session
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        sessions = list(executor.map(play, enumerate(kinds, first_index)))
+    elapsed = time.perf_counter() - start
+
+    # 等待后台写入完成后再测内存
+    import history_store
+    history_store.get_writer().flush(timeout=30)
+    gc.collect()
+    return {
+        "sessions": len(sessions),
+        "elapsed_s": elapsed,
+        "timings": [timing for session in sessions for timing in session.timings],
+        "waits": [wait for session in sessions for wait in session.waits],
+        "errors": [f"{session.name} {error}" for session in sessions for error in session.errors],
+        "rss_before_mb": rss_before,
+        "rss_after_mb": current_rss_mb(),
+        "open_matplotlib_figures": open_figures() - figures_before,
+        "thread_growth": threading.active_count() - threads_before
+    }
+
+
+def run_load(guests, investigators, concurrency, assessments, pages, timeout, processes=1, seed=0):
+    kinds = ["guest"] * guests + ["investigator"] * investigators
+    # 交错排列，两类会话同时进行；按进程轮流分配
+    kinds = [kinds[i] for i in np.random.default_rng(seed).permutation(len(kinds))]
+    shares = [kinds[i::processes] for i in range(processes)]
+    first_indexes = np.cumsum([0] + [len(share) for share in shares[:-1]])
+    args = [(share, int(first), concurrency, assessments, pages, timeout, seed)
+            for share, first in zip(shares, first_indexes)]
+    if processes == 1:
+        parts = [run_sessions(*args[0])]
+    else:
+        # spawn：子进程重新导入模块，不继承父进程的 SQLite 连接和线程
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = list(pool.map(run_sessions, *zip(*args)))
+
+    timings = [timing for part in parts for timing in part["timings"]]
+    by_action = {}
+    for action, seconds in timings:
+        by_action.setdefault(action, []).append(seconds)
+    errors = [error for part in parts for error in part["errors"]]
+    n_sessions = sum(part["sessions"] for part in parts)
+    # 各进程同时运行，总吞吐量为各进程吞吐量之和
+    sessions_per_s = sum(part["sessions"] / part["elapsed_s"] for part in parts if part["elapsed_s"] > 0)
+    assessments_per_s = sum(sum(1 for action, _ in part["timings"] if action == "assess") / part["elapsed_s"]
+                            for part in parts if part["elapsed_s"] > 0)
+    waits = [wait for part in parts for wait in part["waits"]]
+    return {
+        "sessions": n_sessions,
+        "guests": guests,
+        "investigators": investigators,
+        "processes": processes,
+        "concurrency_per_process": concurrency,
+        "elapsed_s": max(part["elapsed_s"] for part in parts),
+        "sessions_per_s": sessions_per_s,
+        "assessments_per_s": assessments_per_s,
+        "reruns": percentiles([seconds for _, seconds in timings]) if timings else None,
+        "reruns_by_action": {action: percentiles(samples) for action, samples in sorted(by_action.items())},
+        "rerun_queue_wait": percentiles(waits) if waits else None,
+        "processes_rss_mb": [{"before": part["rss_before_mb"], "after": part["rss_after_mb"]} for part in parts],
+        # 没有 /proc 的平台上读不到当前内存，为 None
+        "rss_growth_per_session_mb": float(np.mean([(part["rss_after_mb"] - part["rss_before_mb"]) / part["sessions"]
+                                                    for part in parts if part["sessions"]]))
+        if all(part["rss_before_mb"] is not None for part in parts) else None,
+        "open_matplotlib_figures": sum(part["open_matplotlib_figures"] for part in parts),
+        "thread_growth": max(part["thread_growth"] for part in parts),
+        "errors": len(errors),
+        "error_samples": errors[:10]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用 AppTest 模拟并发会话的端到端负载测试")
+    parser.add_argument("--guests", type=int, default=20)
+    parser.add_argument("--investigators", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8, help="每个进程同时进行的会话数")
+    parser.add_argument("--processes", type=int, default=1, help="工作进程数")
+    parser.add_argument("--assessments", type=int, default=3, help="每个会话的评估次数")
+    parser.add_argument("--pages", type=int, default=3, help="调查人员翻阅的历史记录页数")
+    parser.add_argument("--history-rows", type=int, default=500, help="预先写入临时历史记录的行数")
+    parser.add_argument("--history-dir", help="历史记录目录，默认使用临时目录")
+    parser.add_argument("--timeout", type=float, default=120, help="单次重跑的超时秒数")
+    parser.add_argument("--output", help="结果写入的 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    # 必须在导入 history_store（以及执行 app3.py）之前设置
+    os.environ["DR_HISTORY_DIR"] = args.history_dir or tempfile.mkdtemp(prefix="dr_loadtest_")
+    seed_history(args.history_rows)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "history_dir": os.environ["DR_HISTORY_DIR"],
+            "history_backend": os.environ.get("DR_HISTORY_BACKEND", "sqlite"),
+            "assessments_per_session": args.assessments
+        },
+        "result": run_load(args.guests, args.investigators, args.concurrency, args.assessments, args.pages,
+                           args.timeout, args.processes)
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if report["result"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""热路径耗时统计与 Prometheus 导出
+
+用 span(stage) 包住每个阶段（模型推理、SHAP、绘图、历史写入、整次重跑等），
+耗时记录到进程内的直方图中，并保留最近的样本用于界面展示。
+
+导出方式（可同时启用）:
+- DR_METRICS_PORT=9108   在本地端口提供 GET /metrics
+- DR_METRICS_FILE=path   定期原子写入 Prometheus 文本格式文件（textfile collector）
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# 直方图桶上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个阶段保留的最近样本数
+RECENT_SAMPLES = 500
+
+METRICS_PORT = os.environ.get("DR_METRICS_PORT")
+METRICS_FILE = os.environ.get("DR_METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.environ.get("DR_METRICS_FILE_INTERVAL", 15))
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_collector(self, name, kind, help_text, fn):
+        """注册导出时才计算的指标；fn 返回数值，或 {标签元组: 数值} 字典。同名注册会覆盖"""
+        with self._lock:
+            self._collectors[name] = (kind, help_text, fn)
+
+    def stage_summary(self):
+        """各阶段最近样本的次数和延迟分位数（毫秒）"""
+        with self._lock:
+            items = [(stage, h.count, list(h.recent)) for stage, h in self._histograms.items()]
+        summary = []
+        for stage, count, recent in sorted(items):
+            samples = np.asarray(recent) * 1000
+            summary.append({
+                "stage": stage,
+                "count": count,
+                "p50_ms": float(np.percentile(samples, 50)),
+                "p99_ms": float(np.percentile(samples, 99)),
+                "max_ms": float(samples.max())
+            })
+        return summary
+
+    def recent_samples(self, stage):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            return list(histogram.recent) if histogram else []
+
+    def render_prometheus(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            histograms = {stage: (h.buckets, list(h.bucket_counts), h.count, h.sum)
+                          for stage, h in self._histograms.items()}
+            counters = dict(self._counters)
+            collectors = dict(self._collectors)
+
+        lines.append("# HELP dr_stage_duration_seconds Duration of each hot-path stage.")
+        lines.append("# TYPE dr_stage_duration_seconds histogram")
+        for stage, (buckets, bucket_counts, count, total) in sorted(histograms.items()):
+            cumulative = 0
+            for upper, n in zip(buckets, bucket_counts):
+                cumulative += n
+                lines.append(f'dr_stage_duration_seconds_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+            lines.append(f'dr_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'dr_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'dr_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+
+        for name, (kind, help_text, fn) in sorted(collectors.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    lines.append(f"{name}{_format_labels(dict(labels))} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics():
+    return _metrics
+
+
+def span(stage):
+    return _metrics.span(stage)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        data = _metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_started = set()
+_exporters_lock = threading.Lock()
+
+
+def start_http_exporter(port, host="127.0.0.1"):
+    """在后台线程中提供 /metrics，同一进程只启动一次"""
+    with _exporters_lock:
+        if ("http", port) in _exporters_started:
+            return
+        _exporters_started.add(("http", port))
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+def write_textfile(path):
+    """原子写入 Prometheus 文本文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(_metrics.render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def start_textfile_exporter(path, interval=METRICS_FILE_INTERVAL):
+    """在后台线程中定期写入文本文件，同一进程只启动一次"""
+    with _exporters_lock:
+        if ("file", path) in _exporters_started:
+            return
+        _exporters_started.add(("file", path))
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_textfile(path)
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name="metrics-textfile", daemon=True).start()
+
+
+def start_configured_exporters():
+    """按环境变量启动导出器"""
+    if METRICS_PORT:
+        start_http_exporter(METRICS_PORT)
+    if METRICS_FILE:
+        start_textfile_exporter(METRICS_FILE)
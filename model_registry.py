@@ -0,0 +1,229 @@
+"""进程级模型注册表
+
+Streamlit 每次交互都会重新执行 app3.py，但被导入的模块只会加载一次。
+因此把模型和 SHAP 解释器放在本模块的注册表里，所有会话和重跑共享同一份对象；
+文件的 mtime/大小发生变化时再比较内容哈希，确认模型被替换后自动热加载。
+
+SHAP 解释引擎由环境变量 DR_EXPLAINER_ENGINE 选择:
+- native: 使用 CatBoost 自带的 TreeSHAP（默认），不需要加载 explainer.shap
+- pickle: 使用 joblib 反序列化的 shap.TreeExplainer
+
+推理引擎由环境变量 DR_INFERENCE_ENGINE 选择:
+- compiled: 加载时把模型编译为 NumPy 评估器（默认），单行评估不经过 DataFrame/Pool；
+  编译结果与 predict_proba 不一致时自动退回 CatBoost
+- catboost: 直接使用 CatBoostClassifier
+
+多进程部署时设置 DR_MODEL_SHARED_DIR（例如 /dev/shm/dr_model）：第一个加载某个版本的进程把
+编译引擎的数组和 pickle 解释器以可内存映射的格式写入 <目录>/<版本>/，之后各进程以只读内存映射
+打开同一份文件，共享物理内存而不是各自反序列化一份。
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from startup_profile import phase
+
+# 默认模型文件路径
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+DEFAULT_MODEL_PATH = os.path.join(MODEL_DIR, "catboost_model.cbm")
+DEFAULT_EXPLAINER_PATH = os.path.join(MODEL_DIR, "explainer.shap")
+
+EXPLAINER_ENGINES = ("native", "pickle")
+EXPLAINER_ENGINE = os.environ.get("DR_EXPLAINER_ENGINE", "native").lower()
+
+INFERENCE_ENGINES = ("compiled", "catboost")
+INFERENCE_ENGINE = os.environ.get("DR_INFERENCE_ENGINE", "compiled").lower()
+
+# 多进程共享的内存映射模型产物目录，为空时每个进程各自加载
+MODEL_SHARED_DIR = os.environ.get("DR_MODEL_SHARED_DIR", "")
+
+# 一次加载得到的全部产物；version 由实际加载的文件内容哈希得出
+ModelBundle = namedtuple("ModelBundle", ["model", "explainer", "version", "loaded_at"])
+
+
+def _file_stat(path):
+    """返回 (mtime_ns, size)，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _publish(directory, write):
+    """在同级临时目录中生成产物后原子改名；其他进程已经生成时直接使用已有的"""
+    if os.path.isdir(directory):
+        return
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix=".tmp-")
+    try:
+        # mkdtemp 创建的目录只有所有者可读，工作进程可能以其他用户运行
+        os.chmod(tmp, 0o755)
+        write(tmp)
+        os.rename(tmp, directory)
+    except OSError:
+        # 另一个进程先完成了改名
+        if not os.path.isdir(directory):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+class ModelRegistry:
+    """按文件签名缓存 CatBoost 模型和 SHAP 解释器"""
+
+    def __init__(self, model_path, explainer_path, engine=EXPLAINER_ENGINE, inference=INFERENCE_ENGINE,
+                 shared_dir=MODEL_SHARED_DIR):
+        if engine not in EXPLAINER_ENGINES:
+            raise ValueError(f"未知的解释引擎: {engine}")
+        if inference not in INFERENCE_ENGINES:
+            raise ValueError(f"未知的推理引擎: {inference}")
+        self.model_path = model_path
+        self.explainer_path = explainer_path
+        self.engine = engine
+        self.inference = inference
+        self.shared_dir = shared_dir
+        # native 引擎只依赖模型文件
+        self._paths = (model_path,) if engine == "native" else (model_path, explainer_path)
+        self._lock = threading.Lock()
+        self._bundle = None
+        self._stats = None
+        self._hashes = None
+        self._prewarm_thread = None
+        self._prewarm_lock = threading.Lock()
+        self.reload_count = 0
+        self.compile_error = None
+
+    def _current_stats(self):
+        return tuple(_file_stat(path) for path in self._paths)
+
+    def _shared_path(self, version, name):
+        return os.path.join(self.shared_dir, version, name) if self.shared_dir else None
+
+    def _load(self, hashes):
+        version = hashlib.sha256("".join(hashes).encode()).hexdigest()[:12]
+        # catboost、shap 等依赖较重，只在第一次加载模型时导入
+        with phase("import catboost", "import"):
+            from catboost import CatBoostClassifier
+
+        with phase("load catboost_model.cbm"):
+            model = CatBoostClassifier().load_model(self.model_path)
+        if self.engine == "native":
+            from explain import NativeExplainer
+            with phase("init native explainer"):
+                explainer = NativeExplainer(model)
+        else:
+            with phase("import joblib/shap", "import"):
+                import joblib
+                import shap  # noqa: F401  反序列化解释器时需要
+            shared_path = self._shared_path(version, "explainer")
+            if shared_path is None:
+                with phase("load explainer.shap"):
+                    explainer = joblib.load(self.explainer_path)
+            else:
+                # 未压缩的 joblib 文件中的 NumPy 数组可以直接内存映射
+                with phase("publish shared explainer"):
+                    _publish(shared_path, lambda d: joblib.dump(joblib.load(self.explainer_path),
+                                                                os.path.join(d, "explainer.joblib")))
+                with phase("map shared explainer"):
+                    explainer = joblib.load(os.path.join(shared_path, "explainer.joblib"), mmap_mode="r")
+        if self.inference == "compiled":
+            model = self._compile(model, self._shared_path(version, "compiled"))
+        return ModelBundle(model, explainer, version, time.time())
+
+    def _compile(self, model, shared_path=None):
+        """编译为 NumPy 评估器，并在采样输入上核对概率；不一致时使用原模型
+
+        shared_path 不为空时数组写入该目录（已存在则复用）并以只读内存映射加载。
+        """
+        from compiled_model import FALLBACK_ROWS, CompiledModel, check_parity
+        from explain import sample_inputs
+
+        with phase("compile model"):
+            if shared_path is None:
+                compiled = CompiledModel.from_catboost(model, fallback_rows=None)
+            else:
+                _publish(shared_path, lambda d: CompiledModel.from_catboost(model).save(d))
+                compiled = CompiledModel.load(shared_path, fallback_rows=None)
+            parity = check_parity(model, compiled, sample_inputs(model, 256))
+        if not parity["ok"]:
+            self.compile_error = f"max_abs_diff={parity['max_abs_diff']}"
+            return model
+        compiled.fallback = model
+        compiled.fallback_rows = FALLBACK_ROWS
+        return compiled
+
+    def get(self):
+        """返回当前的 ModelBundle，文件变化时重新加载"""
+        stats = self._current_stats()
+        bundle = self._bundle
+        if bundle is not None and stats == self._stats:
+            return bundle
+
+        with self._lock:
+            stats = self._current_stats()
+            if self._bundle is not None and stats == self._stats:
+                return self._bundle
+            for path, stat in zip(self._paths, stats):
+                if stat is None:
+                    raise FileNotFoundError(path)
+
+            hashes = tuple(_file_hash(path) for path in self._paths)
+            # 仅 mtime 变化（例如 touch 或重新拷贝同一文件）时不必重新反序列化
+            if self._bundle is None or hashes != self._hashes:
+                self._bundle = self._load(hashes)
+                self._hashes = hashes
+                self.reload_count += 1
+            self._stats = stats
+            return self._bundle
+
+    @property
+    def version(self):
+        return self.get().version
+
+    @property
+    def loaded(self):
+        return self._bundle is not None
+
+    def prewarm(self):
+        """在后台线程中加载模型；已加载或正在预热时不做任何事"""
+        with self._prewarm_lock:
+            if self._bundle is not None or self._prewarm_thread is not None:
+                return
+            self._prewarm_thread = threading.Thread(target=self._prewarm, name="model-prewarm", daemon=True)
+            self._prewarm_thread.start()
+
+    def _prewarm(self):
+        try:
+            self.get()
+        except Exception:
+            # 预热失败不影响界面，首次评估时会重新加载并显示错误
+            pass
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(model_path=DEFAULT_MODEL_PATH, explainer_path=DEFAULT_EXPLAINER_PATH, engine=EXPLAINER_ENGINE,
+                 inference=INFERENCE_ENGINE):
+    """获取（必要时创建）指定路径、解释引擎和推理引擎的进程级注册表"""
+    key = (os.path.abspath(model_path), os.path.abspath(explainer_path), engine, inference)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = ModelRegistry(*key)
+            _registries[key] = registry
+        return registry
@@ -0,0 +1,87 @@
+"""评估结果缓存
+
+以量化后的 10 项特征和模型版本作为键，缓存风险概率、SHAP 值和渲染好的解释图。
+重复访问、重复点击和示例数据不再重新计算；模型文件被替换后整个缓存失效。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from features import FEATURES
+
+DEFAULT_MAXSIZE = int(os.environ.get("DR_PREDICTION_CACHE_SIZE", 256))
+# 量化精度：四舍五入到小数点后 6 位
+DEFAULT_DECIMALS = 6
+
+
+class PredictionCache:
+    """线程安全的有界 LRU 缓存"""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, decimals=DEFAULT_DECIMALS):
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._model_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, inputs, model_version):
+        """由特征字典和模型版本生成缓存键"""
+        vector = tuple(round(float(inputs[feat]), self.decimals) + 0.0 for feat in FEATURES)
+        return model_version, vector
+
+    def ensure_version(self, model_version):
+        """模型版本变化时清空缓存"""
+        with self._lock:
+            if model_version != self._model_version:
+                self._entries.clear()
+                self._model_version = model_version
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            # 旧模型版本的结果不再写入
+            if self._model_version is not None and key[0] != self._model_version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    """返回进程内共享的评估结果缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache()
+        return _cache
@@ -0,0 +1,264 @@
+"""SHAP 解释图的轻量渲染
+
+直接生成 SVG 字符串，不经过 matplotlib，单次渲染只需字符串拼接。
+- force_plot_svg: 与 shap.force_plot 布局类似的力图
+- waterfall_svg: 按贡献大小排列的瀑布图
+- beeswarm_svg: 群体 SHAP 的蜂群图
+数值均为模型输出（对数几率）空间，与 shap.force_plot 的默认 link='identity' 一致。
+"""
+import html
+import math
+import threading
+
+import numpy as np
+
+POSITIVE_COLOR = "#ff0d57"
+NEGATIVE_COLOR = "#1e88e5"
+
+# pyplot 不是线程安全的，解释图在线程池中渲染时需要串行
+_matplotlib_lock = threading.Lock()
+TEXT_COLOR = "#333"
+AXIS_COLOR = "#999"
+
+
+def _fmt(value):
+    return f"{value:.4g}"
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def _text(x, y, text, size=12, anchor="middle", color=TEXT_COLOR, weight="normal"):
+    return (f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" text-anchor="{anchor}" '
+            f'fill="{color}" font-weight="{weight}" font-family="sans-serif">{html.escape(text)}</text>')
+
+
+def _ticks(lo, hi, n=5):
+    step = (hi - lo) / (n - 1)
+    return [lo + i * step for i in range(n)]
+
+
+def _svg(width, height, body):
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+            f'width="100%" style="max-width:{width}px">' + "".join(body) + '</svg>')
+
+
+def force_plot_svg(expected_value, shap_values, feature_values, feature_names, width=1000):
+    """渲染力图：红色为推高风险的特征，蓝色为降低风险的特征"""
+    base = float(np.ravel(expected_value)[0])
+    shap_values = np.asarray(shap_values, dtype=float)
+    output = base + float(shap_values.sum())
+    positive = sorted((i for i in range(len(shap_values)) if shap_values[i] > 0), key=lambda i: shap_values[i])
+    negative = sorted((i for i in range(len(shap_values)) if shap_values[i] < 0), key=lambda i: shap_values[i])
+    pos_sum = float(shap_values[positive].sum()) if positive else 0.0
+    neg_sum = float(-shap_values[negative].sum()) if negative else 0.0
+
+    lo = min(base, output - pos_sum)
+    hi = max(base, output + neg_sum)
+    pad = (hi - lo) * 0.05 or 1.0
+    lo, hi = lo - pad, hi + pad
+    margin = 20
+    plot_w = width - 2 * margin
+
+    def x(v):
+        return margin + (v - lo) / (hi - lo) * plot_w
+
+    axis_y, bar_y, bar_h = 60, 70, 26
+    body = [f'<line x1="{margin}" y1="{axis_y}" x2="{width - margin}" y2="{axis_y}" stroke="{AXIS_COLOR}"/>']
+    for tick in _ticks(lo, hi):
+        body.append(f'<line x1="{x(tick):.1f}" y1="{axis_y - 4}" x2="{x(tick):.1f}" y2="{axis_y}" stroke="{AXIS_COLOR}"/>')
+        body.append(_text(x(tick), axis_y - 8, _fmt(tick), size=10, color=AXIS_COLOR))
+
+    # 红色段从 f(x)-正贡献之和 开始向右堆叠，贡献越大越靠近 f(x)
+    segments = []
+    start = output - pos_sum
+    for i in positive:
+        segments.append((start, start + shap_values[i], i, POSITIVE_COLOR))
+        start += shap_values[i]
+    # 蓝色段从 f(x) 开始向右堆叠，贡献越大越靠近 f(x)
+    start = output
+    for i in negative:
+        segments.append((start, start - shap_values[i], i, NEGATIVE_COLOR))
+        start -= shap_values[i]
+
+    for seg_lo, seg_hi, i, color in segments:
+        x0, x1 = x(seg_lo), x(seg_hi)
+        body.append(f'<rect x="{x0:.1f}" y="{bar_y}" width="{max(x1 - x0, 0.5):.1f}" height="{bar_h}" '
+                    f'fill="{color}" stroke="white" stroke-width="1"/>')
+        if x1 - x0 >= 70:
+            label = f"{feature_names[i]} = {_fmt(float(feature_values[i]))}"
+            body.append(_text((x0 + x1) / 2, bar_y + bar_h + 16, label, size=11, color=color))
+
+    body.append(f'<line x1="{x(base):.1f}" y1="{bar_y - 4}" x2="{x(base):.1f}" y2="{bar_y + bar_h + 4}" '
+                f'stroke="{AXIS_COLOR}" stroke-dasharray="3,2"/>')
+    body.append(_text(x(base), bar_y + bar_h + 34, f"base value {_fmt(base)}", size=11, color=AXIS_COLOR))
+    body.append(_text(x(output), 22, f"f(x) = {_fmt(output)}  (p = {_sigmoid(output):.3f})", size=14, weight="bold"))
+    body.append(_text(margin, 22, "higher →", size=11, anchor="start", color=POSITIVE_COLOR))
+    body.append(_text(width - margin, 22, "← lower", size=11, anchor="end", color=NEGATIVE_COLOR))
+    return _svg(width, bar_y + bar_h + 44, body)
+
+
+def waterfall_svg(expected_value, shap_values, feature_values, feature_names, width=800):
+    """渲染瀑布图：从基准值开始按贡献大小逐项累加到 f(x)"""
+    base = float(np.ravel(expected_value)[0])
+    shap_values = np.asarray(shap_values, dtype=float)
+    order = sorted(range(len(shap_values)), key=lambda i: abs(shap_values[i]), reverse=True)
+    output = base + float(shap_values.sum())
+
+    cumulative = [base]
+    for i in order:
+        cumulative.append(cumulative[-1] + shap_values[i])
+    lo, hi = min(cumulative), max(cumulative)
+    pad = (hi - lo) * 0.08 or 1.0
+    lo, hi = lo - pad, hi + pad
+    label_w, margin, row_h, top = 180, 20, 26, 30
+    plot_w = width - label_w - 2 * margin
+
+    def x(v):
+        return label_w + margin + (v - lo) / (hi - lo) * plot_w
+
+    height = top + row_h * len(order) + 40
+    body = [_text(x(output), 18, f"f(x) = {_fmt(output)}  (p = {_sigmoid(output):.3f})", size=13, weight="bold")]
+    for row, i in enumerate(order):
+        y = top + row * row_h
+        start, end = cumulative[row], cumulative[row + 1]
+        color = POSITIVE_COLOR if shap_values[i] > 0 else NEGATIVE_COLOR
+        x0, x1 = sorted((x(start), x(end)))
+        body.append(_text(label_w, y + row_h / 2 + 4,
+                          f"{feature_names[i]} = {_fmt(float(feature_values[i]))}", anchor="end"))
+        body.append(f'<rect x="{x0:.1f}" y="{y + 4}" width="{max(x1 - x0, 0.5):.1f}" height="{row_h - 8}" fill="{color}"/>')
+        body.append(_text(x1 + 4, y + row_h / 2 + 4, f"{shap_values[i]:+.3f}", size=11, anchor="start", color=color))
+
+    axis_y = top + row_h * len(order) + 6
+    body.append(f'<line x1="{x(lo):.1f}" y1="{axis_y}" x2="{x(hi):.1f}" y2="{axis_y}" stroke="{AXIS_COLOR}"/>')
+    for tick in _ticks(lo, hi):
+        body.append(_text(x(tick), axis_y + 16, _fmt(tick), size=10, color=AXIS_COLOR))
+    body.append(f'<line x1="{x(base):.1f}" y1="{top}" x2="{x(base):.1f}" y2="{axis_y}" '
+                f'stroke="{AXIS_COLOR}" stroke-dasharray="3,2"/>')
+    return _svg(width, height, body)
+
+
+def force_plot_png(expected_value, shap_values, feature_row):
+    """matplotlib 后备渲染：调用 shap.force_plot 并返回 PNG 字节"""
+    import io
+
+    import matplotlib.pyplot as plt
+    import shap
+
+    with _matplotlib_lock:
+        fig = shap.force_plot(
+            expected_value,
+            shap_values,
+            feature_row,
+            matplotlib=True,
+            show=False
+        )
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", bbox_inches="tight", dpi=200)
+        plt.close(fig)
+    return buf.getvalue()
+
+
+def _blend(color_a, color_b, t):
+    a = [int(color_a[i:i + 2], 16) for i in (1, 3, 5)]
+    b = [int(color_b[i:i + 2], 16) for i in (1, 3, 5)]
+    return "#" + "".join(f"{round(x + (y - x) * t):02x}" for x, y in zip(a, b))
+
+
+def heatmap_svg(x_axis, y_axis, values, x_label, y_label, marker=None, width=600, height=420):
+    """渲染两项指标网格上的风险概率热图，values 形状为 (len(x_axis), len(y_axis))，取值 0~1
+
+    颜色从蓝色（低风险）经白色到红色（高风险）；marker 为当前输入 (x, y)。
+    """
+    values = np.asarray(values, dtype=float)
+    left, bottom, top, right = 70, 50, 20, 80
+    plot_w, plot_h = width - left - right, height - top - bottom
+    x_lo, x_hi, y_lo, y_hi = x_axis[0], x_axis[-1], y_axis[0], y_axis[-1]
+
+    def x(v):
+        return left + (v - x_lo) / ((x_hi - x_lo) or 1.0) * plot_w
+
+    def y(v):
+        return top + plot_h - (v - y_lo) / ((y_hi - y_lo) or 1.0) * plot_h
+
+    def color(p):
+        return _blend("#ffffff", NEGATIVE_COLOR, 1 - 2 * p) if p < 0.5 else _blend("#ffffff", POSITIVE_COLOR, 2 * p - 1)
+
+    cell_w, cell_h = plot_w / len(x_axis), plot_h / len(y_axis)
+    body = []
+    for i in range(len(x_axis)):
+        for j in range(len(y_axis)):
+            body.append(f'<rect x="{left + i * cell_w:.1f}" y="{top + plot_h - (j + 1) * cell_h:.1f}" '
+                        f'width="{cell_w + 0.5:.1f}" height="{cell_h + 0.5:.1f}" fill="{color(values[i, j])}"/>')
+    for tick in _ticks(x_lo, x_hi):
+        body.append(_text(x(tick), top + plot_h + 16, _fmt(tick), size=10, color=AXIS_COLOR))
+    for tick in _ticks(y_lo, y_hi):
+        body.append(_text(left - 6, y(tick) + 4, _fmt(tick), size=10, anchor="end", color=AXIS_COLOR))
+    body.append(_text(left + plot_w / 2, height - 10, x_label, size=12))
+    body.append(f'<text x="16" y="{top + plot_h / 2:.1f}" font-size="12" text-anchor="middle" fill="{TEXT_COLOR}" '
+                f'font-family="sans-serif" transform="rotate(-90 16 {top + plot_h / 2:.1f})">{html.escape(y_label)}</text>')
+    if marker is not None:
+        body.append(f'<circle cx="{x(marker[0]):.1f}" cy="{y(marker[1]):.1f}" r="6" fill="none" '
+                    f'stroke="{TEXT_COLOR}" stroke-width="2"/>')
+
+    # 图例
+    legend_x = left + plot_w + 25
+    for k in range(20):
+        p = 1 - k / 19
+        body.append(f'<rect x="{legend_x}" y="{top + k * plot_h / 20:.1f}" width="16" '
+                    f'height="{plot_h / 20 + 0.5:.1f}" fill="{color(p)}"/>')
+    body.append(_text(legend_x + 20, top + 10, "1.0", size=10, anchor="start", color=AXIS_COLOR))
+    body.append(_text(legend_x + 20, top + plot_h, "0.0", size=10, anchor="start", color=AXIS_COLOR))
+    return _svg(width, height, body)
+
+
+def beeswarm_svg(shap_values, feature_values, feature_names, max_points=500, width=800, row_height=36):
+    """渲染多条记录的 SHAP 蜂群图，shap_values / feature_values 形状为 (记录数, 特征数)
+
+    特征按平均 |SHAP| 从上到下排列；每个点是一条记录，横坐标为 SHAP 值，
+    同一 SHAP 区间内的点上下错开；颜色为该特征取值在全部记录中的百分位（蓝色低、红色高）。
+    每个特征最多绘制 max_points 个点。
+    """
+    shap_values = np.asarray(shap_values, dtype=float)
+    feature_values = np.asarray(feature_values, dtype=float)
+    if len(shap_values) > max_points:
+        keep = np.random.default_rng(0).choice(len(shap_values), max_points, replace=False)
+        shap_values, feature_values = shap_values[keep], feature_values[keep]
+    order = np.argsort(-np.abs(shap_values).mean(axis=0))
+    left, right, top, bottom = 120, 30, 10, 40
+    plot_w = width - left - right
+    height = top + bottom + row_height * len(feature_names)
+    lo, hi = float(min(shap_values.min(initial=0.0), 0.0)), float(max(shap_values.max(initial=0.0), 0.0))
+
+    def x(v):
+        return left + (v - lo) / ((hi - lo) or 1.0) * plot_w
+
+    body = [f'<line x1="{x(0):.1f}" y1="{top}" x2="{x(0):.1f}" y2="{height - bottom}" stroke="{AXIS_COLOR}"/>']
+    n_bins = 100
+    for row, i in enumerate(order):
+        center = top + row_height * (row + 0.5)
+        body.append(_text(left - 8, center + 4, feature_names[i], size=11, anchor="end"))
+        values = shap_values[:, i]
+        # 按 SHAP 区间分组，组内依次上下交替排开，按最拥挤区间的点数缩放到行高之内
+        bins = np.clip(((values - lo) / ((hi - lo) or 1.0) * n_bins).astype(int), 0, n_bins - 1)
+        sorted_idx = np.argsort(bins, kind="stable")
+        sorted_bins = bins[sorted_idx]
+        starts = np.searchsorted(sorted_bins, sorted_bins)
+        rank = np.empty(len(values), dtype=int)
+        rank[sorted_idx] = np.arange(len(values)) - starts
+        offsets = (rank + 1) // 2 * np.where(rank % 2, 1, -1)
+        spread = max(int(np.abs(offsets).max(initial=0)), 1)
+        offsets = offsets / spread * min(row_height * 0.4, spread * 2.0)
+        # 特征取值的百分位
+        raw = feature_values[:, i]
+        pct = np.argsort(np.argsort(raw, kind="stable"), kind="stable") / max(len(raw) - 1, 1)
+        body.append('<g fill-opacity="0.8">')
+        for v, dy, p in zip(values, offsets, pct):
+            body.append(f'<circle cx="{x(v):.1f}" cy="{center + dy:.1f}" r="2" '
+                        f'fill="{_blend(NEGATIVE_COLOR, POSITIVE_COLOR, p)}"/>')
+        body.append('</g>')
+    for tick in _ticks(lo, hi):
+        body.append(_text(x(tick), height - bottom + 16, _fmt(tick), size=10, color=AXIS_COLOR))
+    body.append(_text(left + plot_w / 2, height - 6, "SHAP", size=12))
+    return _svg(width, height, body)
@@ -0,0 +1,119 @@
+"""历史记录重新评估任务
+
+用当前模型按主键顺序分批读取历史记录的特征列，整批向量化评估后把新概率和模型版本
+写在原评分旁边（Rescore_Probability / Rescore_Model_Version）。任务在后台线程中运行，
+每批完成后把进度写入检查点文件；中断（取消、进程重启）后再次启动会从检查点继续。
+中断期间检查点之前的记录被删除或归档时（CSV 的行号会前移），从头重新评估。
+
+用法: python rescore.py --chunk-size 50000
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from feature_schema import FEATURE_SCHEMA
+from history_jobs import HistoryJob, history_changed, row_key
+from metrics import span
+
+DEFAULT_CHUNK_SIZE = int(os.environ.get("DR_RESCORE_CHUNK_SIZE", 50000))
+
+
+def checkpoint_path(store):
+    return store.path + ".rescore.json"
+
+
+def load_checkpoint(store):
+    try:
+        with open(checkpoint_path(store), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_checkpoint(store, checkpoint):
+    path = checkpoint_path(store)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_rescore(store, bundle, chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, cancel_event=None):
+    """执行（或继续）重新评估，返回最终进度"""
+    checkpoint = load_checkpoint(store)
+    if checkpoint is None or checkpoint.get("model_version") != bundle.version or checkpoint.get("status") == "done" \
+            or history_changed(store, checkpoint):
+        # 换了模型、上一次已完成或检查点之前的记录有变化：从头开始
+        checkpoint = {"model_version": bundle.version, "last_id": -1, "last_row": None, "done": 0,
+                      "status": "running", "started_at": time.time()}
+    else:
+        checkpoint["status"] = "running"
+    total = checkpoint["done"] + store.count_after(checkpoint["last_id"])
+    start = time.perf_counter()
+    processed = 0
+
+    def report(**extra):
+        elapsed = time.perf_counter() - start
+        progress = dict(model_version=bundle.version, done=checkpoint["done"], total=total,
+                        rows_per_s=processed / elapsed if elapsed > 0 else None, **extra)
+        if progress_callback is not None:
+            progress_callback(**progress)
+        return progress
+
+    report(status="running")
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            checkpoint["status"] = "cancelled"
+            save_checkpoint(store, checkpoint)
+            return report(status="cancelled")
+        chunk = store.feature_chunk(checkpoint["last_id"], chunk_size)
+        if chunk.empty:
+            break
+        with span("rescore_chunk"):
+            # 与新评估相同的校验：未通过的行（例如手工改过的 CSV）重新评估的概率留空
+            validation = FEATURE_SCHEMA.validate_frame(chunk)
+            probs = np.full(len(chunk), np.nan)
+            accepted = ~validation.rejected
+            if accepted.any():
+                probs[accepted] = bundle.model.predict_proba(validation.values.to_numpy()[accepted])[:, 1]
+            store.write_rescores(chunk, probs, bundle.version)
+        checkpoint["last_id"] = int(chunk.index[-1])
+        checkpoint["last_row"] = row_key(chunk)
+        checkpoint["done"] += len(chunk)
+        processed += len(chunk)
+        save_checkpoint(store, checkpoint)
+        report(status="running")
+
+    checkpoint["status"] = "done"
+    checkpoint["finished_at"] = time.time()
+    save_checkpoint(store, checkpoint)
+    return report(status="done")
+
+
+_job = HistoryJob(run_rescore, DEFAULT_CHUNK_SIZE)
+
+
+def get_rescore_job():
+    return _job
+
+
+def main():
+    import argparse
+
+    import history_store
+    from model_registry import get_registry
+
+    parser = argparse.ArgumentParser(description="用当前模型重新评估历史记录（可中断后继续）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    def print_progress(**progress):
+        print(f"{progress['status']}: {progress['done']}/{progress['total']}", flush=True)
+
+    result = run_rescore(history_store.get_store(), get_registry().get(), args.chunk_size, print_progress)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
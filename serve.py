@@ -0,0 +1,261 @@
+"""本地 HTTP/JSON 评估服务
+
+与 Streamlit 界面共用特征列表、单位、风险阈值、模型注册表和历史记录写入。
+几毫秒内并发到达的请求会被合并成一次 predict_proba（/explain 同时合并 shap_values）调用。
+
+用法: python serve.py --port 8502 --batch-wait-ms 5 --max-batch-size 256
+
+接口:
+    GET  /health   模型版本
+    GET  /schema   特征列表、单位和风险阈值
+    GET  /metrics  各阶段耗时直方图（Prometheus 文本格式）
+    POST /predict  {"records": [{"Name": ..., "Gender": ..., "Cortisol": ..., ...}], "save": false}
+    POST /explain  同 /predict，结果中附带每个特征的 SHAP 值
+单条记录也可以直接作为请求体提交。
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import history_store
+from feature_schema import FEATURE_SCHEMA
+from features import FEATURES, UNITS, RISK_THRESHOLDS, risk_level
+from metrics import get_metrics, span
+from model_registry import get_registry
+from shadow import get_shadow_scorer
+
+
+class MicroBatcher:
+    """把短时间内到达的并发请求合并成一次模型调用
+
+    score_fn 接收 (n, 特征数) 的数组，返回按行对齐的数组或数组元组。
+    """
+
+    def __init__(self, score_fn, max_wait_ms=5, max_batch_size=256):
+        self.score_fn = score_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """提交若干行特征，返回结果的 Future"""
+        future = Future()
+        self._queue.put((np.asarray(rows, dtype=float), future))
+        return future
+
+    def _collect(self):
+        items = [self._queue.get()]
+        n_rows = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            n_rows += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                results = self.score_fn(np.vstack([rows for rows, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for rows, future in items:
+                end = start + len(rows)
+                if isinstance(results, tuple):
+                    future.set_result(tuple(r[start:end] for r in results))
+                else:
+                    future.set_result(results[start:end])
+                start = end
+
+
+def predict_rows(X):
+    bundle = get_registry().get()
+    with span("serve_predict_batch"):
+        probs = bundle.model.predict_proba(X)[:, 1]
+    # 合并后的整批输入交给挑战者评估一次
+    get_shadow_scorer().submit(X, probs, bundle.version)
+    return probs
+
+
+def explain_rows(X):
+    bundle = get_registry().get()
+    with span("serve_predict_batch"):
+        probs = bundle.model.predict_proba(X)[:, 1]
+    get_shadow_scorer().submit(X, probs, bundle.version)
+    with span("serve_shap_batch"):
+        shap_values = np.asarray(bundle.explainer.shap_values(pd.DataFrame(X, columns=FEATURES)))
+    return probs, shap_values
+
+
+def _is_scalar(value):
+    return value is None or (isinstance(value, (int, float, str)) and not isinstance(value, bool))
+
+
+def parse_records(payload):
+    """从请求体中取出记录列表和特征矩阵
+
+    缺少特征、数值无效或超出范围时抛出 ValueError；null 按特征的缺失值处理方式处理。
+    """
+    if isinstance(payload, dict) and "records" in payload:
+        records = payload["records"]
+    else:
+        records = [payload]
+    if not isinstance(records, list) or not records:
+        raise ValueError("records 必须是非空列表")
+
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError(f"第 {i} 条记录不是对象")
+        missing = [feat for feat in FEATURES if feat not in record]
+        if missing:
+            raise ValueError(f"第 {i} 条记录缺少特征: {', '.join(missing)}")
+    # 数字或 null 以外的值（例如布尔值、嵌套对象）同样视为无效；在构造 DataFrame 前逐个检查，
+    # 不依赖只有较新 pandas 才有的 DataFrame.map
+    df = pd.DataFrame([[record[feat] if _is_scalar(record[feat]) else "invalid" for feat in FEATURES]
+                       for record in records], columns=FEATURES)
+    validation = FEATURE_SCHEMA.validate_frame(df)
+    if validation.rejected.any():
+        issues = FEATURE_SCHEMA.issues(validation)
+        details = "; ".join(f"第 {i} 条记录: {issues.iloc[i]}" for i in np.flatnonzero(validation.rejected)[:10])
+        raise ValueError(f"包含无效或超出范围的数值 - {details}")
+    return records, validation.values.to_numpy(dtype=float)
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    predict_batcher = None
+    explain_batcher = None
+    request_timeout = 30
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "model_version": get_registry().version})
+        elif self.path == "/schema":
+            self._send_json(200, {
+                "features": FEATURES,
+                "units": UNITS,
+                "specs": FEATURE_SCHEMA.describe(),
+                "risk_thresholds": list(RISK_THRESHOLDS)
+            })
+        elif self.path == "/metrics":
+            data = get_metrics().render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path not in ("/predict", "/explain"):
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"null")
+            records, X = parse_records(payload)
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        explain = self.path == "/explain"
+        batcher = self.explain_batcher if explain else self.predict_batcher
+        try:
+            with span("serve_explain" if explain else "serve_predict"):
+                result = batcher.submit(X).result(timeout=self.request_timeout)
+        except Exception as e:
+            self._send_json(500, {"error": f"评估失败: {str(e)}"})
+            return
+        probs, shap_values = result if explain else (result, None)
+
+        bundle = get_registry().get()
+        results = []
+        for i, prob in enumerate(probs):
+            item = {"risk_probability": float(prob), "risk_level": risk_level(prob)}
+            if explain:
+                item["shap_values"] = dict(zip(FEATURES, shap_values[i].tolist()))
+            results.append(item)
+        body = {"model_version": bundle.version, "results": results}
+        if explain:
+            body["expected_value"] = float(np.ravel(bundle.explainer.expected_value)[0])
+
+        if isinstance(payload, dict) and payload.get("save"):
+            # 与界面一样放入后台写入队列，合并提交，请求线程不等待数据库写锁
+            try:
+                with span("history_write"):
+                    history_store.get_writer().submit([
+                        history_store.make_record(record.get("Name", ""), record.get("Gender", ""),
+                                                  dict(zip(FEATURES, row)), float(prob),
+                                                  model_version=bundle.version)
+                        for record, row, prob in zip(records, X, probs)
+                    ])
+                body["saved"] = len(records)
+            except Exception as e:
+                body["save_error"] = f"保存记录失败: {str(e)}"
+
+        self._send_json(200, body)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认监听队列只有 5，并发请求较多时会被拒绝连接
+    request_queue_size = 128
+
+
+def make_server(host="127.0.0.1", port=8502, batch_wait_ms=5, max_batch_size=256):
+    """创建服务并预先加载模型"""
+    get_registry().get()
+    get_shadow_scorer().prewarm()
+    ScoringHandler.predict_batcher = MicroBatcher(predict_rows, batch_wait_ms, max_batch_size)
+    ScoringHandler.explain_batcher = MicroBatcher(explain_rows, batch_wait_ms, max_batch_size)
+    return ScoringServer((host, port), ScoringHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DR 风险评估 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--batch-wait-ms", type=float, default=5)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.batch_wait_ms, args.max_batch_size)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""影子评估（冠军 / 挑战者）
+
+model/ 目录下除冠军模型（catboost_model.cbm）以外的 *.cbm 文件作为挑战者加载。
+界面和 HTTP 服务只显示、保存冠军的概率（Risk_Probability）；同一批输入在冠军评估后
+提交到这里的线程池，各挑战者并行地对整批输入调用一次 predict_proba，
+结果写入单独的 SQLite 数据库（shadow_scores.db），供离线比较。
+
+请求线程只做一次数组拷贝和入队，不等待挑战者；增加的延迟记在 shadow_submit 阶段，
+挑战者本身的耗时记在 shadow_score 阶段。排队的任务超过上限时直接丢弃新的批次，
+挑战者变慢或出错都不会拖慢冠军。
+
+DR_CHALLENGERS         逗号分隔的挑战者文件名；auto（默认）为 model/ 下其余全部 .cbm，none 关闭
+DR_SHADOW_WORKERS      线程数，默认 2
+DR_SHADOW_MAX_PENDING  排队中的挑战者任务上限，默认 64
+
+用法: python shadow.py   按挑战者汇总与冠军的差异，结果以 JSON 输出
+"""
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from features import RISK_THRESHOLDS
+from history_store import HISTORY_DIR, beijing_timestamp
+from history_aggregates import risk_bands
+from metrics import get_metrics, span
+from model_registry import DEFAULT_EXPLAINER_PATH, DEFAULT_MODEL_PATH, MODEL_DIR, get_registry
+
+CHALLENGERS = os.environ.get("DR_CHALLENGERS", "auto").strip()
+SHADOW_WORKERS = int(os.environ.get("DR_SHADOW_WORKERS", 2))
+SHADOW_MAX_PENDING = int(os.environ.get("DR_SHADOW_MAX_PENDING", 64))
+SHADOW_DB_PATH = os.path.join(HISTORY_DIR, "shadow_scores.db")
+
+SHADOW_COLUMNS = ["Timestamp", "Name", "Champion_Version", "Champion_Probability",
+                  "Challenger", "Challenger_Version", "Challenger_Probability", "Latency_ms"]
+
+
+def challenger_paths(model_dir=MODEL_DIR, champion_path=DEFAULT_MODEL_PATH, challengers=CHALLENGERS):
+    """挑战者模型文件列表，按文件名排序"""
+    if challengers.lower() in ("", "none"):
+        return []
+    if challengers.lower() == "auto":
+        paths = glob.glob(os.path.join(model_dir, "*.cbm"))
+    else:
+        paths = [os.path.join(model_dir, name.strip()) for name in challengers.split(",") if name.strip()]
+    champion = os.path.abspath(champion_path)
+    return sorted(path for path in paths if os.path.abspath(path) != champion)
+
+
+class ShadowStore:
+    """挑战者评估结果，每个挑战者每条输入一行"""
+
+    def __init__(self, path=SHADOW_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS shadow_scores ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, Timestamp TEXT NOT NULL, Name TEXT, "
+                    "Champion_Version TEXT, Champion_Probability REAL, Challenger TEXT NOT NULL, "
+                    "Challenger_Version TEXT, Challenger_Probability REAL, Latency_ms REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_shadow_challenger ON shadow_scores(Challenger)")
+            self._local.conn = conn
+        return conn
+
+    def append_records(self, rows):
+        """rows 为按 SHADOW_COLUMNS 排列的元组"""
+        conn = self._connect()
+        columns = ", ".join(SHADOW_COLUMNS)
+        with conn:
+            conn.executemany(f"INSERT INTO shadow_scores ({columns}) VALUES ({', '.join('?' for _ in SHADOW_COLUMNS)})",
+                             rows)
+
+    def load(self, limit=None):
+        sql = f"SELECT {', '.join(SHADOW_COLUMNS)} FROM shadow_scores ORDER BY id"
+        if limit is not None:
+            sql += f" DESC LIMIT {int(limit)}"
+        return pd.read_sql_query(sql, self._connect())
+
+    def summary(self):
+        """按挑战者（及其版本）汇总：记录数、与冠军的平均/最大绝对差、风险等级一致率、评估耗时"""
+        df = self.load()
+        if df.empty:
+            return pd.DataFrame()
+        df["Abs_Diff"] = (df["Challenger_Probability"] - df["Champion_Probability"]).abs()
+        df["Same_Level"] = risk_bands(df["Challenger_Probability"]) == risk_bands(df["Champion_Probability"])
+        grouped = df.groupby(["Challenger", "Challenger_Version"])
+        return pd.DataFrame({
+            "n": grouped.size(),
+            "mean_abs_diff": grouped["Abs_Diff"].mean(),
+            "max_abs_diff": grouped["Abs_Diff"].max(),
+            "same_risk_level": grouped["Same_Level"].mean(),
+            # 一个批次的各行记录同一个耗时
+            "p50_latency_ms": grouped["Latency_ms"].median(),
+            "p99_latency_ms": grouped["Latency_ms"].quantile(0.99)
+        }).reset_index()
+
+
+class ShadowScorer:
+    """在后台线程池中用挑战者评估与冠军相同的输入"""
+
+    def __init__(self, store, paths, workers=SHADOW_WORKERS, max_pending=SHADOW_MAX_PENDING):
+        self.store = store
+        self.paths = list(paths)
+        self.max_pending = max_pending
+        self.last_error = None
+        self.dropped = 0
+        self._registries = [get_registry(path, DEFAULT_EXPLAINER_PATH, engine="native") for path in self.paths]
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shadow") if self.paths else None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.paths)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def prewarm(self):
+        for registry in self._registries:
+            registry.prewarm()
+
+    def submit(self, X, champion_probs, champion_version, names=None):
+        """提交一批已由冠军评估的输入，立即返回；队列已满时丢弃并返回 False"""
+        if not self.paths:
+            return False
+        with span("shadow_submit"):
+            with self._lock:
+                if self._pending + len(self._registries) > self.max_pending:
+                    self.dropped += 1
+                    get_metrics().inc("dr_shadow_dropped_total")
+                    return False
+                self._pending += len(self._registries)
+            X = np.array(X, dtype=float, ndmin=2)
+            champion_probs = np.ravel(np.asarray(champion_probs, dtype=float))
+            names = [""] * len(X) if names is None else [str(name) for name in names]
+            timestamp = beijing_timestamp()
+            for path, registry in zip(self.paths, self._registries):
+                self._executor.submit(self._score, os.path.basename(path), registry, X, champion_probs,
+                                      champion_version, names, timestamp)
+        return True
+
+    def _score(self, challenger, registry, X, champion_probs, champion_version, names, timestamp):
+        try:
+            bundle = registry.get()
+            start = time.perf_counter()
+            with span("shadow_score"):
+                probs = bundle.model.predict_proba(X)[:, 1]
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.store.append_records([
+                (timestamp, name, champion_version, float(champion_prob), challenger, bundle.version,
+                 float(prob), latency_ms)
+                for name, champion_prob, prob in zip(names, champion_probs, probs)
+            ])
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{challenger}: {type(e).__name__}: {e}"
+            get_metrics().inc("dr_shadow_errors_total", challenger=challenger)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def flush(self, timeout=None):
+        """等待已提交的任务完成，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+
+def get_shadow_scorer():
+    """返回进程内共享的影子评估器；没有挑战者时 submit 不做任何事"""
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            _scorer = ShadowScorer(ShadowStore(), challenger_paths())
+        return _scorer
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="汇总挑战者与冠军模型的评估差异")
+    parser.add_argument("--db", default=SHADOW_DB_PATH)
+    args = parser.parse_args()
+    summary = ShadowStore(args.db).summary()
+    print(json.dumps({"risk_thresholds": RISK_THRESHOLDS, "challengers": summary.to_dict(orient="records")},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""启动耗时统计
+
+进程内按阶段记录导入（import）和产物加载（load）的耗时，供界面展示。
+运行 python startup_profile.py 会在全新的子进程中依次测量各依赖的导入耗时
+和模型产物的加载耗时，以 JSON 输出。
+"""
+import json
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROCESS_START = time.time()
+
+_phases = []
+_recorded = set()
+_lock = threading.Lock()
+
+
+def record(name, kind, seconds):
+    with _lock:
+        _phases.append({
+            "name": name,
+            "kind": kind,
+            "ms": seconds * 1000,
+            "thread": threading.current_thread().name,
+            "at": time.time() - PROCESS_START
+        })
+
+
+def record_once(name, kind, seconds):
+    """同名阶段只记录第一次，用于 Streamlit 重跑时会重复执行的代码"""
+    with _lock:
+        if name in _recorded:
+            return
+        _recorded.add(name)
+    record(name, kind, seconds)
+
+
+@contextmanager
+def phase(name, kind="load"):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, kind, time.perf_counter() - start)
+
+
+def report():
+    """返回各阶段耗时及按类型汇总的总耗时"""
+    with _lock:
+        phases = list(_phases)
+    totals = {}
+    for item in phases:
+        totals[item["kind"]] = totals.get(item["kind"], 0.0) + item["ms"]
+    return {"uptime_s": time.time() - PROCESS_START, "totals_ms": totals, "phases": phases}
+
+
+# 子进程中执行的测量脚本：依次导入各模块并加载模型产物，后导入的模块不再计入已加载的公共依赖
+_COLD_START_SCRIPT = r"""
+import json, sys, time
+sys.path.insert(0, {base_dir!r})
+phases = []
+def timed(name, kind, fn):
+    start = time.perf_counter()
+    result = fn()
+    phases.append({{"name": name, "kind": kind, "ms": (time.perf_counter() - start) * 1000}})
+    return result
+for module in {modules!r}:
+    timed(module, "import", lambda: __import__(module))
+from model_registry import DEFAULT_MODEL_PATH, DEFAULT_EXPLAINER_PATH
+from catboost import CatBoostClassifier
+model = timed("catboost_model.cbm", "load", lambda: CatBoostClassifier().load_model(DEFAULT_MODEL_PATH))
+from explain import NativeExplainer
+timed("native explainer", "load", lambda: NativeExplainer(model))
+if {include_pickle!r}:
+    import joblib
+    timed("explainer.shap", "load", lambda: joblib.load(DEFAULT_EXPLAINER_PATH))
+print(json.dumps(phases))
+"""
+
+DEFAULT_MODULES = ["streamlit", "numpy", "pandas", "pytz", "sqlite3", "catboost", "joblib",
+                   "matplotlib.pyplot", "shap"]
+
+
+def measure_cold_start(modules=DEFAULT_MODULES, include_pickle=True):
+    """在全新的子进程中测量导入和加载耗时"""
+    import os
+
+    script = _COLD_START_SCRIPT.format(base_dir=os.path.dirname(os.path.abspath(__file__)),
+                                       modules=list(modules), include_pickle=include_pickle)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    phases = json.loads(output.strip().splitlines()[-1])
+    totals = {}
+    for item in phases:
+        totals[item["kind"]] = totals.get(item["kind"], 0.0) + item["ms"]
+    return {"wall_ms": (time.perf_counter() - start) * 1000, "totals_ms": totals, "phases": phases}
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure_cold_start(), indent=2))
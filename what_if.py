@@ -0,0 +1,88 @@
+"""假设分析（部分依赖曲线）
+
+固定患者其余指标，让一项或两项指标在取值范围内变化：整张网格一次 predict_proba、
+一次 shap_values 批量计算，结果按患者输入缓存，拖动滑块时只查表，不再重新评估。
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from feature_schema import FEATURE_SCHEMA
+from features import FEATURES
+from prediction_cache import PredictionCache
+
+# 单项指标的网格点数；两项指标时每个方向的点数
+GRID_POINTS_1D = 60
+GRID_POINTS_2D = 25
+
+
+def feature_range(model, feat, current=None):
+    """取值范围：模型在该特征上的分裂边界两侧各留 10%，并包含当前输入值，不超出特征的合理范围"""
+    borders = model.get_borders().get(FEATURES.index(feat)) or [0.0, 1.0]
+    low, high = min(borders), max(borders)
+    margin = (high - low) * 0.1 or 1.0
+    # 化验指标没有负值，边界都非负时下限不低于 0
+    low = max(low - margin, 0.0) if low >= 0 else low - margin
+    high = high + margin
+    if current is not None:
+        low, high = min(low, current), max(high, current)
+    valid_low, valid_high = FEATURE_SCHEMA.ranges[feat]
+    return max(low, valid_low), min(high, valid_high)
+
+
+def make_grid(model, inputs, features):
+    n_points = GRID_POINTS_1D if len(features) == 1 else GRID_POINTS_2D
+    return [np.linspace(*feature_range(model, feat, inputs[feat]), n_points) for feat in features]
+
+
+def score_grid(model, explainer, inputs, features):
+    """对一项或两项指标的网格评估风险概率和 SHAP 值
+
+    返回字典: features, axes（各指标的取值）, prob（网格形状）, shap（网格形状 + 特征数）
+    """
+    if not 1 <= len(features) <= 2:
+        raise ValueError("假设分析只支持一项或两项指标")
+    axes = make_grid(model, inputs, features)
+    shape = tuple(len(axis) for axis in axes)
+    X = np.tile(np.array([float(inputs[feat]) for feat in FEATURES]), (int(np.prod(shape)), 1))
+    for feat, values in zip(features, np.meshgrid(*axes, indexing="ij")):
+        X[:, FEATURES.index(feat)] = values.ravel()
+
+    prob = model.predict_proba(X)[:, 1]
+    shap_values = np.asarray(explainer.shap_values(pd.DataFrame(X, columns=FEATURES)))
+    return {
+        "features": list(features),
+        "axes": axes,
+        "prob": prob.reshape(shape),
+        "shap": shap_values.reshape(shape + (len(FEATURES),)),
+        "rows": X.reshape(shape + (len(FEATURES),))
+    }
+
+
+def nearest_index(axis, value):
+    return int(np.abs(np.asarray(axis) - value).argmin())
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_what_if_cache():
+    """返回进程内共享的网格结果缓存，键为 (模型版本, 患者输入, 指标)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache(maxsize=64)
+        return _cache
+
+
+def cached_score_grid(bundle, inputs, features):
+    cache = get_what_if_cache()
+    cache.ensure_version(bundle.version)
+    key = cache.key(inputs, bundle.version) + (tuple(features),)
+    result = cache.get(key)
+    if result is None:
+        result = score_grid(bundle.model, bundle.explainer, inputs, features)
+        cache.put(key, result)
+    return result